@@ -7,21 +7,18 @@ and displays the original and grayscale versions side-by-side.
 
 import cv2
 import numpy as np
-from picamzero import Camera
+from vision.frame_source import CameraGrabber, ThreadedFrameSource
 
-# Initialize camera
-cam = Camera()
+# Initialize camera (frames are captured in a background thread, already in BGR format)
+source = ThreadedFrameSource(CameraGrabber())
+source.start()
 
 print("Starting Grayscale script. Press 'q' to exit.")
 
 try:
     while True:
-        # Capture frame as numpy array using underlying Picamera2 instance
-        frame = cam.pc2.capture_array()
-
-        # FIX: Check if frame has 4 channels (RGBA/BGRA) and convert to 3 channels (BGR)
-        if frame.shape[2] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+        # Get the newest captured frame as numpy array
+        frame = source.read()
 
         # Convert to grayscale
         gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
@@ -45,5 +42,5 @@ except Exception as e:
     print(f"An error occurred: {e}")
 finally:
     cv2.destroyAllWindows()
-    cam.stop_preview() # Good practice to ensure resources are released
+    source.stop() # Good practice to ensure resources are released
 
@@ -6,11 +6,12 @@ Contrast is the difference in luminance or color that makes an object distinguis
 '''
 
 import cv2
-import numpy as np
-from picamzero import Camera
+from vision.frame_source import CameraGrabber, ThreadedFrameSource
+from vision.tone import ToneMapper, add_trackbars
 
-# Initialize camera
-cam = Camera()
+# Initialize camera (frames are captured in a background thread, already in BGR format)
+source = ThreadedFrameSource(CameraGrabber())
+source.start()
 
 # Contrast factor (Alpha)
 # 1.0 = original
@@ -19,26 +20,35 @@ cam = Camera()
 alpha = 2
 beta = 0 # Brightness (no change)
 
+# New = Alpha * Old + Beta gives the same result for every pixel with the same value,
+# so it is computed once for all 256 values and stored in a lookup table (see vision/tone.py)
+tone = ToneMapper(alpha=alpha, beta=beta)
+
+# Sliders to change alpha, beta and gamma while the script runs (the table is rebuilt only then)
+window = "Left: Original | Right: Contrast"
+cv2.namedWindow(window)
+add_trackbars(window, tone)
+
 print(f"Starting Contrast script (Alpha={alpha}). Press 'q' to exit.")
 
 try:
     while True:
-        # Capture frame
-        frame = cam.pc2.capture_array()
-
-        # FIX: Check if frame has 4 channels (RGBA/BGRA) and convert to 3 channels (BGR)
-        if frame.shape[2] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+        # Get the newest captured frame
+        frame = source.read()
 
         # Apply contrast adjustment: New = Alpha * Old + Beta
-        # convertScaleAbs handles clamping to 0-255 automatically
-        contrast_frame = cv2.convertScaleAbs(frame, alpha=alpha, beta=beta)
+        # The lookup table already contains the clamping to 0-255
+        contrast_frame = tone.apply(frame)
 
         # Stack images side-by-side
         combined = cv2.hconcat([frame, contrast_frame])
 
+        # Show the current settings on the image (window titles stay static)
+        text = f"Contrast factor = {tone.alpha:.2f}, gamma = {tone.gamma:.2f}"
+        cv2.putText(combined, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+
         # Display
-        cv2.imshow(f"Left: Original | Right: Contrast factor = {alpha}", combined)
+        cv2.imshow(window, combined)
 
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
@@ -49,4 +59,4 @@ except Exception as e:
     print(f"An error occurred: {e}")
 finally:
     cv2.destroyAllWindows()
-
+    source.stop()
@@ -6,11 +6,12 @@ Brightness refers to the overall lightness or darkness of the image.
 '''
 
 import cv2
-import numpy as np
-from picamzero import Camera
+from vision.frame_source import CameraGrabber, ThreadedFrameSource
+from vision.tone import ToneMapper, add_trackbars
 
-# Initialize camera
-cam = Camera()
+# Initialize camera (frames are captured in a background thread, already in BGR format)
+source = ThreadedFrameSource(CameraGrabber())
+source.start()
 
 # Brightness increase (Beta)
 # Positive value = brighter
@@ -18,25 +19,34 @@ cam = Camera()
 beta = 50
 alpha = 1.0 # Contrast (no change)
 
+# New = Alpha * Old + Beta gives the same result for every pixel with the same value,
+# so it is computed once for all 256 values and stored in a lookup table (see vision/tone.py)
+tone = ToneMapper(alpha=alpha, beta=beta)
+
+# Sliders to change alpha, beta and gamma while the script runs (the table is rebuilt only then)
+window = "Left: Original | Right: Brightness"
+cv2.namedWindow(window)
+add_trackbars(window, tone)
+
 print(f"Starting Brightness script (Beta={beta}). Press 'q' to exit.")
 
 try:
     while True:
-        # Capture frame
-        frame = cam.pc2.capture_array()
-
-        # FIX: Check if frame has 4 channels (RGBA/BGRA) and convert to 3 channels (BGR)
-        if frame.shape[2] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+        # Get the newest captured frame
+        frame = source.read()
 
         # Apply brightness adjustment: New = Alpha * Old + Beta
-        bright_frame = cv2.convertScaleAbs(frame, alpha=alpha, beta=beta)
+        bright_frame = tone.apply(frame)
 
         # Stack images side-by-side
         combined = cv2.hconcat([frame, bright_frame])
 
+        # Show the current settings on the image (window titles stay static)
+        text = f"Brightness increase = {tone.beta}, gamma = {tone.gamma:.2f}"
+        cv2.putText(combined, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+
         # Display
-        cv2.imshow(f"Left: Original | Right: Brightness increase = {beta}", combined)
+        cv2.imshow(window, combined)
 
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
@@ -47,4 +57,4 @@ except Exception as e:
     print(f"An error occurred: {e}")
 finally:
     cv2.destroyAllWindows()
-
+    source.stop()
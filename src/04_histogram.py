@@ -6,57 +6,34 @@ A histogram represents the distribution of pixel intensities in the image.
 '''
 
 import cv2
-import numpy as np
-from picamzero import Camera
+from vision.frame_source import CameraGrabber, ThreadedFrameSource
+from vision.histogram import HistogramEngine
 
-# Initialize camera
-cam = Camera()
+# Initialize camera (frames are captured in a background thread, already in BGR format)
+source = ThreadedFrameSource(CameraGrabber())
+source.start()
 
-print("Starting Histogram script. Press 'q' to exit.")
+# Histogram engine (see vision/histogram.py):
+#   step=4     count every 4th pixel in both directions - 16x less work, nearly the same histogram
+#   decay=0.8  smooth the curves over time so they do not flicker from frame to frame
+# The B, G and R histograms are drawn in their colour, the luma (intensity) histogram in white.
+engine = HistogramEngine(step=4, decay=0.8)
 
-def draw_histogram(img, color=(255, 255, 255)):
-    # Convert to grayscale for simple intensity histogram
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
-    # Calculate histogram
-    # images, channels, mask, histSize, ranges
-    hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
-    
-    # Create an image to draw the histogram on
-    hist_h, hist_w = 400, 512
-    hist_img = np.zeros((hist_h, hist_w, 3), dtype=np.uint8)
-    
-    # Normalize histogram to fit in the image height
-    cv2.normalize(hist, hist, alpha=0, beta=hist_h, norm_type=cv2.NORM_MINMAX)
-    
-    # Draw lines for the histogram
-    for i in range(1, 256):
-        # Point 1: (x, y) - Note: y is inverted because image origin is top-left
-        pt1 = (int((i - 1) * (hist_w / 256)), hist_h - int(hist[i - 1]))
-        pt2 = (int(i * (hist_w / 256)), hist_h - int(hist[i]))
-        cv2.line(hist_img, pt1, pt2, color, thickness=2)
-        
-    return hist_img
+print("Starting Histogram script. Press 'q' to exit.")
 
 try:
     while True:
-        # Capture frame
-        frame = cam.pc2.capture_array()
+        # Get the newest captured frame
+        frame = source.read()
 
-        # FIX: Check if frame has 4 channels (RGBA/BGRA) and convert to 3 channels (BGR)
-        if frame.shape[2] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
-
-        # Resize frame to match histogram height for cleaner stacking (optional but looks better)
-        # Let's just resize the histogram image to match the frame height if needed, 
-        # or resize frame to fixed width. 
-        # For simplicity, we'll just resize the histogram plot to match frame height.
+        # Update the (smoothed) histograms and draw them directly at the frame size,
+        # so no resize is needed before stacking
         h, w = frame.shape[:2]
-        hist_img = draw_histogram(frame)
-        hist_img_resized = cv2.resize(hist_img, (w, h))
+        engine.update(frame)
+        hist_img = engine.render((h, w))
 
         # Stack images side-by-side
-        combined = cv2.hconcat([frame, hist_img_resized])
+        combined = cv2.hconcat([frame, hist_img])
 
         # Display
         cv2.imshow("Left: Original | Right: Histogram", combined)
@@ -70,4 +47,4 @@ except Exception as e:
     print(f"An error occurred: {e}")
 finally:
     cv2.destroyAllWindows()
-
+    source.stop()
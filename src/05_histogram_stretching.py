@@ -2,42 +2,37 @@
 Lecture 2
 Topic: Histogram Stretching (Contrast Stretching)
 This script improves the contrast of the image by stretching the range of intensity values.
-It makes the darkest pixel 0 and the brightest pixel 255, scaling everything in between.
+It makes the darkest pixels 0 and the brightest pixels 255, scaling everything in between.
 '''
 
 import cv2
-import numpy as np
-from picamzero import Camera
-
-# Initialize camera
-cam = Camera()
+from vision.frame_source import CameraGrabber, ThreadedFrameSource
+from vision.ingest import GRAY
+from vision.stretching import ContrastStretcher
+
+# Initialize camera (frames are captured in a background thread)
+# This script only needs grayscale, so we ask the camera for the luma (brightness) image directly
+source = ThreadedFrameSource(CameraGrabber(pixel_format=GRAY))
+source.start()
+
+# Contrast stretcher (see vision/stretching.py)
+# Instead of the single darkest/brightest pixel (np.min / np.max) we use the 1% and 99%
+# percentiles of the histogram: a few hot or dead pixels can no longer spoil the stretch.
+# smoothing=0.8 lets the bounds follow the scene slowly, so the image does not flicker.
+# For colour frames try mode="per_channel" or mode="hsv_v" (stretch only the brightness).
+stretcher = ContrastStretcher(low=1, high=99, smoothing=0.8, mode="gray")
 
 print("Starting Histogram Stretching script. Press 'q' to exit.")
 
 try:
     while True:
-        # Capture frame
-        frame = cam.pc2.capture_array()
-
-        # FIX: Check if frame has 4 channels (RGBA/BGRA) and convert to 3 channels (BGR)
-        if frame.shape[2] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
-
-        # Convert to grayscale for simple stretching (or stretch V channel in HSV)
-        # Here we stretch the grayscale version for visualization
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-        # Find min and max pixel values
-        min_val = np.min(gray)
-        max_val = np.max(gray)
+        # Get the newest captured frame (already grayscale)
+        gray = source.read()
 
-        # Avoid division by zero if image is solid color
-        if max_val - min_val > 0:
-            # Apply Min-Max Stretching: (pixel - min) * (255 / (max - min))
-            # We use cv2.normalize which is faster and cleaner
-            stretched = cv2.normalize(gray, None, 0, 255, cv2.NORM_MINMAX)
-        else:
-            stretched = gray
+        # Apply Stretching: (pixel - low) * (255 / (high - low)), clipped to 0-255
+        # This is done with a 256-entry lookup table (cv2.LUT) that is only rebuilt when the bounds move
+        stretched = stretcher.apply(gray)
+        min_val, max_val = stretcher.bounds[0]
 
         # Convert back to BGR for stacking
         stretched_bgr = cv2.cvtColor(stretched, cv2.COLOR_GRAY2BGR)
@@ -48,8 +43,8 @@ try:
         # Stack images side-by-side
         combined = cv2.hconcat([gray_bgr, stretched_bgr])
 
-        # Add text to the image to show min/max values instead of using window title
-        text = f"Min: {min_val}, Max: {max_val}"
+        # Add text to the image to show the stretch bounds instead of using window title
+        text = f"Low (1%): {min_val}, High (99%): {max_val}"
         cv2.putText(combined, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
 
         # Display with a STATIC window name
@@ -64,3 +59,4 @@ except Exception as e:
     print(f"An error occurred: {e}")
 finally:
     cv2.destroyAllWindows()
+    source.stop()
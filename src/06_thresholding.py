@@ -7,31 +7,34 @@ It separates "object" pixels (white) from "background/noise" pixels (black) base
 
 import cv2
 import numpy as np
-from picamzero import Camera
+from vision.frame_source import CameraGrabber, ThreadedFrameSource
+from vision.ingest import GRAY
+from vision.segmentation import Segmenter
 
-# Initialize camera
-cam = Camera()
+# Initialize camera (frames are captured in a background thread)
+# This script only needs grayscale, so we ask the camera for the luma (brightness) image directly
+source = ThreadedFrameSource(CameraGrabber(pixel_format=GRAY))
+source.start()
 
 # Threshold value (0-255)
+# A fixed value like 127 stops working when the lighting changes, so the segmenter finds it
+# automatically with Otsu's method (see vision/segmentation.py). Other modes: "fixed" (uses
+# thresh_val), "triangle", "adaptive_mean" and "adaptive_gaussian" (a threshold per pixel).
 thresh_val = 127
+segmenter = Segmenter(mode="otsu", thresh=thresh_val)
 
-print(f"Starting Thresholding script (Threshold={thresh_val}). Press 'q' to exit.")
+print(f"Starting Thresholding script (mode={segmenter.mode}). Press 'q' to exit.")
 
 try:
     while True:
-        # Capture frame
-        frame = cam.pc2.capture_array()
-
-        # FIX: Check if frame has 4 channels (RGBA/BGRA) and convert to 3 channels (BGR)
-        if frame.shape[2] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
-
-        # Convert to grayscale (thresholding is typically done on grayscale images)
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        # Get the newest captured frame (already grayscale - thresholding is typically done on grayscale images)
+        gray = source.read()
 
         # Apply Binary Thresholding
-        # ret is the threshold value used (useful for Otsu's), binary is the result image
-        ret, binary = cv2.threshold(gray, thresh_val, 255, cv2.THRESH_BINARY)
+        # The threshold is computed from a histogram of every 4th pixel and reused until it is
+        # 10 frames old or the brightness changes. Same as: cv2.threshold(gray, ret, 255, cv2.THRESH_BINARY)
+        binary = segmenter.segment(gray)
+        ret = segmenter.threshold
 
         # Convert binary to BGR for stacking
         binary_bgr = cv2.cvtColor(binary, cv2.COLOR_GRAY2BGR)
@@ -42,8 +45,11 @@ try:
         # Stack images side-by-side
         combined = cv2.hconcat([gray_bgr, binary_bgr])
 
+        # Add text overlay (the threshold changes with the scene)
+        cv2.putText(combined, f"Threshold ({segmenter.mode}): {ret}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+
         # Display
-        cv2.imshow(f"Left: Grayscale | Right: Binary Threshold ({thresh_val})", combined)
+        cv2.imshow("Left: Grayscale | Right: Binary Threshold", combined)
 
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
@@ -54,4 +60,5 @@ except Exception as e:
     print(f"An error occurred: {e}")
 finally:
     cv2.destroyAllWindows()
+    source.stop()
 
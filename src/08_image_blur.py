@@ -7,34 +7,39 @@ Blurring is often used to reduce noise or detail in an image.
 
 import cv2
 import numpy as np
-from picamzero import Camera
+from vision.blur import GaussianBlurEngine
+from vision.frame_source import CameraGrabber, ThreadedFrameSource
 
-# Initialize camera
-cam = Camera()
+# Initialize camera (frames are captured in a background thread, already in BGR format)
+source = ThreadedFrameSource(CameraGrabber())
+source.start()
 
 print("Starting Image Blur script. Press 'q' to exit.")
 
 # Kernel size (must be odd numbers, e.g. (3,3), (5,5), (15,15))
 ksize = (15, 15)
 
+# The cost of a direct k x k convolution grows with the kernel AREA. The blur engine
+# (see vision/blur.py) picks a cheaper method for the requested size:
+#   small kernels  -> two 1D passes (rows, then columns) with a cached kernel
+#   large kernels  -> shrink the image (pyramid), blur the small image, scale it back up
+# Try ksize = (101, 101): cv2.GaussianBlur gets very slow, the engine does not.
+blur = GaussianBlurEngine(ksize=ksize[0])
+
 try:
     while True:
-        # Capture frame
-        frame = cam.pc2.capture_array()
-
-        # FIX: Check if frame has 4 channels (RGBA/BGRA) and convert to 3 channels (BGR)
-        if frame.shape[2] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+        # Get the newest captured frame
+        frame = source.read()
 
         # Apply Gaussian Blur
-        # sigmaX=0 means standard deviation is calculated from kernel size
-        blurred = cv2.GaussianBlur(frame, ksize, 0)
+        # sigma is calculated from kernel size (like sigmaX=0 in cv2.GaussianBlur(frame, ksize, 0))
+        blurred = blur.apply(frame)
 
         # Stack images side-by-side
         combined = cv2.hconcat([frame, blurred])
 
         # Add text overlay
-        cv2.putText(combined, f"Kernel: {ksize}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+        cv2.putText(combined, f"Kernel: {ksize} ({blur.method})", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
 
         # Display
         cv2.imshow("Left: Original | Right: Gaussian Blur", combined)
@@ -48,4 +53,5 @@ except Exception as e:
     print(f"An error occurred: {e}")
 finally:
     cv2.destroyAllWindows()
+    source.stop()
 
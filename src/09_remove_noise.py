@@ -8,28 +8,32 @@ unlike standard Gaussian blur which blurs edges too.
 
 import cv2
 import numpy as np
-from picamzero import Camera
+from vision.frame_source import CameraGrabber, ThreadedFrameSource
+from vision.tiling import bilateral_filter
 
-# Initialize camera
-cam = Camera()
+# Initialize camera (frames are captured in a background thread, already in BGR format)
+source = ThreadedFrameSource(CameraGrabber())
+source.start()
+
+# The bilateral filter is the slowest filter of the course. The tiled version splits the frame
+# into overlapping strips and filters them on all CPU cores at the same time (see vision/tiling.py).
+# The result is exactly the same as cv2.bilateralFilter on the full frame.
+bilateral = bilateral_filter(d=9, sigmaColor=75, sigmaSpace=75)
 
 print("Starting Noise Removal script. Press 'q' to exit.")
 
 try:
     while True:
-        # Capture frame
-        frame = cam.pc2.capture_array()
-
-        # FIX: Check if frame has 4 channels (RGBA/BGRA) and convert to 3 channels (BGR)
-        if frame.shape[2] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+        # Get the newest captured frame
+        frame = source.read()
 
         # Apply Bilateral Filter
         # d: Diameter of each pixel neighborhood (negative -> computed from sigmaSpace)
         # sigmaColor: Filter sigma in the color space (larger value means farther colors are mixed)
         # sigmaSpace: Filter sigma in the coordinate space (larger value means farther pixels affect each other)
-        # Note: This can be computationally expensive on RPi!
-        denoised = cv2.bilateralFilter(frame, d=9, sigmaColor=75, sigmaSpace=75)
+        # Note: This can be computationally expensive on RPi! (that is why it runs tiled on all cores)
+        # Same as: denoised = cv2.bilateralFilter(frame, d=9, sigmaColor=75, sigmaSpace=75)
+        denoised = bilateral.process(frame)
 
         # Stack images side-by-side
         combined = cv2.hconcat([frame, denoised])
@@ -49,4 +53,6 @@ except Exception as e:
     print(f"An error occurred: {e}")
 finally:
     cv2.destroyAllWindows()
+    source.stop()
+    bilateral.close()
 
@@ -7,10 +7,13 @@ It finds areas with strong intensity gradients.
 
 import cv2
 import numpy as np
-from picamzero import Camera
+from vision.frame_source import CameraGrabber, ThreadedFrameSource
+from vision.ingest import GRAY
 
-# Initialize camera
-cam = Camera()
+# Initialize camera (frames are captured in a background thread)
+# This script only needs grayscale, so we ask the camera for the luma (brightness) image directly
+source = ThreadedFrameSource(CameraGrabber(pixel_format=GRAY))
+source.start()
 
 print("Starting Edge Detection script. Press 'q' to exit.")
 
@@ -20,30 +23,24 @@ threshold2 = 200
 
 try:
     while True:
-        # Capture frame
-        frame = cam.pc2.capture_array()
-
-        # FIX: Check if frame has 4 channels (RGBA/BGRA) and convert to 3 channels (BGR)
-        if frame.shape[2] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
-
-        # Convert to grayscale (Canny works on single channel)
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        # Get the newest captured frame (already grayscale - Canny works on single channel)
+        gray = source.read()
 
         # Apply Canny Edge Detection
         edges = cv2.Canny(gray, threshold1, threshold2)
 
-        # Convert edges back to BGR to stack with original frame
+        # Convert gray and edges back to BGR so the colored text overlay shows up
+        gray_bgr = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
         edges_bgr = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
 
         # Stack images side-by-side
-        combined = cv2.hconcat([frame, edges_bgr])
+        combined = cv2.hconcat([gray_bgr, edges_bgr])
 
         # Add text overlay
         cv2.putText(combined, f"Canny Thresholds: {threshold1}, {threshold2}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
 
         # Display
-        cv2.imshow("Left: Original | Right: Canny Edges", combined)
+        cv2.imshow("Left: Grayscale | Right: Canny Edges", combined)
 
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
@@ -54,4 +51,5 @@ except Exception as e:
     print(f"An error occurred: {e}")
 finally:
     cv2.destroyAllWindows()
+    source.stop()
 
@@ -7,24 +7,24 @@ Each pixel is replaced by the average value of its neighbors.
 
 import cv2
 import numpy as np
-from picamzero import Camera
+from vision.frame_source import CameraGrabber, ThreadedFrameSource
 
-# Initialize camera
-cam = Camera()
+# Initialize camera (frames are captured in a background thread, already in BGR format)
+source = ThreadedFrameSource(CameraGrabber())
+source.start()
 
 print("Starting Mean Filter script. Press 'q' to exit.")
 
 # Kernel size
 ksize = (5, 5)
 
+# vision/constant_time.py shows how a box filter can cost the same for every kernel size
+# (integral image, running sums). Those versions are for reading only: cv2.blur is faster.
+
 try:
     while True:
-        # Capture frame
-        frame = cam.pc2.capture_array()
-
-        # FIX: Check if frame has 4 channels (RGBA/BGRA) and convert to 3 channels (BGR)
-        if frame.shape[2] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+        # Get the newest captured frame
+        frame = source.read()
 
         # Apply Mean Filter (cv2.blur)
         blurred = cv2.blur(frame, ksize)
@@ -47,4 +47,5 @@ except Exception as e:
     print(f"An error occurred: {e}")
 finally:
     cv2.destroyAllWindows()
+    source.stop()
 
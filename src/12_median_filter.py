@@ -8,24 +8,24 @@ It is very effective at removing "Salt and Pepper" noise (random white/black dot
 
 import cv2
 import numpy as np
-from picamzero import Camera
+from vision.frame_source import CameraGrabber, ThreadedFrameSource
 
-# Initialize camera
-cam = Camera()
+# Initialize camera (frames are captured in a background thread, already in BGR format)
+source = ThreadedFrameSource(CameraGrabber())
+source.start()
 
 print("Starting Median Filter script. Press 'q' to exit.")
 
 # Kernel size (must be odd integer, e.g. 3, 5, 7)
 ksize = 5
 
+# vision/constant_time.py shows how a median can cost the same for every kernel size (window
+# histograms). That version is for reading only: it takes about a second per frame.
+
 try:
     while True:
-        # Capture frame
-        frame = cam.pc2.capture_array()
-
-        # FIX: Check if frame has 4 channels (RGBA/BGRA) and convert to 3 channels (BGR)
-        if frame.shape[2] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+        # Get the newest captured frame
+        frame = source.read()
 
         # Apply Median Blur
         # Note: ksize is a single integer here, not a tuple
@@ -49,4 +49,5 @@ except Exception as e:
     print(f"An error occurred: {e}")
 finally:
     cv2.destroyAllWindows()
+    source.stop()
 
@@ -7,37 +7,44 @@ It makes bright regions grow (dilate). Useful for joining broken parts of an obj
 '''
 
 import cv2
-import numpy as np
-from picamzero import Camera
+from vision.frame_source import CameraGrabber, ThreadedFrameSource
+from vision.ingest import GRAY
+from vision.morphology import BinaryMorphology
+from vision.segmentation import Segmenter
 
-# Initialize camera
-cam = Camera()
+# Initialize camera (frames are captured in a background thread)
+# This script only needs grayscale, so we ask the camera for the luma (brightness) image directly
+source = ThreadedFrameSource(CameraGrabber(pixel_format=GRAY))
+source.start()
 
 print("Starting Dilation script. Press 'q' to exit.")
 
-# Kernel for morphological operations
-kernel = np.ones((5, 5), np.uint8)
+# Bit-packed morphology engine (see vision/morphology.py)
+# A binary mask needs only 1 bit per pixel: the engine stores 64 pixels in one 64-bit number
+# (8x less memory than a uint8 mask) and applies the 5x5 square as a row pass and a column pass.
+# The result is exactly the same as cv2.dilate(binary, 5x5 kernel of ones).
+morph = BinaryMorphology(ksize=5, iterations=1)
 
 # Threshold for binary conversion
-thresh_val = 127
+# Found automatically with Otsu's method instead of a fixed 127 (see vision/segmentation.py)
+segmenter = Segmenter(mode="otsu")
 
 try:
     while True:
-        # Capture frame
-        frame = cam.pc2.capture_array()
+        # Get the newest captured frame (already grayscale)
+        gray = source.read()
 
-        # FIX: Check if frame has 4 channels (RGBA/BGRA) and convert to 3 channels (BGR)
-        if frame.shape[2] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
-
-        # Convert to grayscale and then binary threshold
-        # Morphology works best on binary images
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        _, binary = cv2.threshold(gray, thresh_val, 255, cv2.THRESH_BINARY)
+        # Binary threshold - morphology works best on binary images
+        # The threshold goes straight into the packed mask of the morphology engine
+        # (same as cv2.threshold(gray, segmenter.threshold, 255, cv2.THRESH_BINARY))
+        mask = segmenter.segment_packed(gray, morph)
+        # uint8 version for the display (a copy, the engine reuses its output buffer)
+        binary = morph.unpack(mask).copy()
 
         # Apply Dilation
         # iterations: how many times to apply the operation
-        dilated = cv2.dilate(binary, kernel, iterations=1)
+        # Same as: dilated = cv2.dilate(binary, 5x5 kernel of ones)
+        dilated = morph.unpack(morph.dilate(mask))
 
         # Convert back to BGR for stacking
         binary_bgr = cv2.cvtColor(binary, cv2.COLOR_GRAY2BGR)
@@ -61,4 +68,5 @@ except Exception as e:
     print(f"An error occurred: {e}")
 finally:
     cv2.destroyAllWindows()
+    source.stop()
 
@@ -4,53 +4,54 @@ Topic: Feature Detection (ORB)
 This script detects keypoints in the image using ORB (Oriented FAST and Rotated BRIEF).
 ORB is a fast, rotation invariant feature detector (good alternative to SIFT/SURF).
 Keypoints are interesting points in the image (corners, edges) that can be tracked.
+The frame is split into a grid of cells with their own keypoint budget, so the keypoints are
+spread over the whole image, and only cells whose content changed are detected again
+(see vision/features.py).
 '''
 
 import cv2
 import numpy as np
-from picamzero import Camera
+from vision.features import GridOrb
+from vision.frame_source import CameraGrabber, ThreadedFrameSource
+from vision.ingest import GRAY
 
-# Initialize camera
-cam = Camera()
+# Initialize camera (frames are captured in a background thread)
+# This script only needs grayscale, so we ask the camera for the luma (brightness) image directly
+source = ThreadedFrameSource(CameraGrabber(pixel_format=GRAY))
+source.start()
 
 print("Starting ORB Feature Detection script. Press 'q' to exit.")
 
 # Initialize ORB detector
-# nfeatures: maximum number of features to retain
-orb = cv2.ORB_create(nfeatures=500)
+# nfeatures: maximum number of features to retain (split over the 4x3 grid cells)
+# change_threshold: a cell is detected again when it changed by more than this (gray levels)
+orb = GridOrb(nfeatures=500, cols=4, rows=3, change_threshold=12)
 
 try:
     while True:
-        # Capture frame
-        frame = cam.pc2.capture_array()
+        # Get the newest captured frame (already grayscale - detectors usually work on grayscale)
+        gray = source.read()
 
-        # FIX: Check if frame has 4 channels (RGBA/BGRA) and convert to 3 channels (BGR)
-        if frame.shape[2] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+        # Detect keypoints and compute their descriptors in one pass
+        # (descriptors are what matching and tracking need later, one row of 32 bytes per keypoint)
+        kp, des = orb.detect_and_compute(gray)
 
-        # Convert to grayscale (Detectors usually work on grayscale)
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-        # Detect keypoints
-        # find the keypoints with ORB
-        kp = orb.detect(gray, None)
-
-        # Compute descriptors (optional, not needed just for drawing)
-        # kp, des = orb.compute(gray, kp)
-
-        # Draw keypoints on the original color image
+        # Draw keypoints on the grayscale image (the result is a color image)
         # color=(0,255,0): Green keypoints
         # flags=0: Draw only keypoints, not size and orientation
-        img_keypoints = cv2.drawKeypoints(frame, kp, None, color=(0, 255, 0), flags=0)
+        gray_bgr = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+        img_keypoints = cv2.drawKeypoints(gray_bgr, kp, None, color=(0, 255, 0), flags=0)
 
         # Stack images side-by-side
-        combined = cv2.hconcat([frame, img_keypoints])
+        combined = cv2.hconcat([gray_bgr, img_keypoints])
 
         # Add text overlay
         cv2.putText(combined, f"ORB Keypoints: {len(kp)} detected", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+        cv2.putText(combined, f"Cells detected: {orb.stats()['detected_cells']:.0%}", (10, 65),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
 
         # Display
-        cv2.imshow("Left: Original | Right: ORB Features", combined)
+        cv2.imshow("Left: Grayscale | Right: ORB Features", combined)
 
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
@@ -61,4 +62,6 @@ except Exception as e:
     print(f"An error occurred: {e}")
 finally:
     cv2.destroyAllWindows()
+    orb.close()
+    source.stop()
 
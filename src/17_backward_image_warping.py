@@ -7,52 +7,85 @@ pixels_dst[x, y] = pixels_src[T^-1(x, y)]
 
 This is the standard approach in computer vision (like cv2.warpAffine) because it guarantees
 every destination pixel gets a value (no holes), using interpolation (bilinear, etc.) for non-integer coordinates.
+
+Press 'r' to take the current frame as the reference view of a planar object (a book, a poster).
+From then on the transform is not a synthetic rotation any more: it is ESTIMATED every frame from
+ORB matches with the reference (a homography, see vision/homography.py), and the frame is
+warped back into the reference view. Press 'r' again for a new reference.
 '''
 
 import cv2
 import numpy as np
-from picamzero import Camera
+from vision.frame_source import CameraGrabber, ThreadedFrameSource
+from vision.homography import PlanarRegistration
+from vision.warp_cache import WarpCache
 
-# Initialize camera
-cam = Camera()
+# Initialize camera (frames are captured in a background thread, already in BGR format)
+source = ThreadedFrameSource(CameraGrabber())
+source.start()
 
 print("Starting Backward Warping script. Press 'q' to exit.")
 
+# Cache of remap tables (see vision/warp_cache.py)
+# The source position of every destination pixel only depends on the transform and the image size,
+# so for a transform that is used again they are computed once and stored as a fixed-point remap
+# table. A transform seen for the first time is warped directly with cv2.warpAffine.
+# With angle_step = 0 the rotation stays fixed and every frame is one cached cv2.remap pass.
+warp_cache = WarpCache(capacity=8)
+angle_step = 1
+
+# Registration onto a reference view (None until 'r' is pressed)
+registration = None
+
 try:
     angle = 0
     while True:
-        # Capture frame
-        frame = cam.pc2.capture_array()
-
-        # FIX: Check if frame has 4 channels (RGBA/BGRA) and convert to 3 channels (BGR)
-        if frame.shape[2] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+        # Get the newest captured frame
+        frame = source.read()
 
         h, w = frame.shape[:2]
         center = (w // 2, h // 2)
         
         # Increment angle
-        angle = (angle + 1) % 360
+        angle = (angle + angle_step) % 360
         
         # Calculate Rotation Matrix (2x3)
         # cv2.getRotationMatrix2D creates the matrix for BACKWARD mapping logic internally
         M = cv2.getRotationMatrix2D(center, angle, 1.0)
         
-        # Apply Affine Transformation (Backward Warping)
-        # cv2.warpAffine iterates over destination pixels and interpolates from source
-        warped = cv2.warpAffine(frame, M, (w, h))
+        if registration is None:
+            # Apply Affine Transformation (Backward Warping)
+            # Iterates over destination pixels and interpolates from source
+            # Same as: warped = cv2.warpAffine(frame, M, (w, h))
+            warped = warp_cache.warp(frame, M)
+            text = "Backward Warping (Smooth, No holes)"
+        else:
+            # Estimate the homography frame -> reference (PROSAC on ORB matches), then warp
+            # the frame back into the reference view with the same backward warping
+            registration.estimate(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+            warped = registration.warp(frame)
+            if warped is None:
+                warped = np.zeros_like(frame)      # the object was not found yet
+            info = registration.info
+            text = f"Registered: {info['inliers']}/{info['matches']} inliers, {info['iterations']} samples"
 
         # Stack images
         combined = cv2.hconcat([frame, warped])
 
         # Add text
-        cv2.putText(combined, "Backward Warping (Smooth, No holes)", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+        cv2.putText(combined, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
 
         # Display
         cv2.imshow("Left: Original | Right: Backward Warp", combined)
 
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+        key = cv2.waitKey(1) & 0xFF
+        if key == ord('q'):
             break
+        if key == ord('r'):
+            # The current frame becomes the reference view
+            if registration is not None:
+                registration.close()
+            registration = PlanarRegistration(frame)
 
 except KeyboardInterrupt:
     pass
@@ -60,4 +93,7 @@ except Exception as e:
     print(f"An error occurred: {e}")
 finally:
     cv2.destroyAllWindows()
+    if registration is not None:
+        registration.close()
+    source.stop()
 
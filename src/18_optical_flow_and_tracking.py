@@ -3,87 +3,56 @@ Lecture 4
 Topic: Optical Flow and Tracking (Lucas-Kanade)
 This script demonstrates Sparse Optical Flow using the Lucas-Kanade method.
 It detects feature points (corners) and tracks them from frame to frame.
-Press 'r' to re-detect points if tracking is lost.
+
+The tracks are managed by vision/tracking.py:
+- every track has an ID, an age and a short history (drawn as its trail)
+- every point is tracked forward and then back again; a track that does not come back to its
+  start (forward-backward check) has drifted and is dropped
+- new corners are only detected in grid cells that (nearly) ran out of tracks, so the number
+  of tracks stays steady without re-detecting on the whole frame
+Press 'r' to drop all tracks and start again.
 '''
 
 import cv2
-import numpy as np
-from picamzero import Camera
+from vision.frame_source import CameraGrabber, ThreadedFrameSource
+from vision.tracking import TrackManager
 
-# Initialize camera
-cam = Camera()
+# Initialize camera (frames are captured in a background thread, already in BGR format)
+source = ThreadedFrameSource(CameraGrabber())
+source.start()
 
 print("Starting Optical Flow script.")
 print("Press 'q' to exit.")
 print("Press 'r' to re-initialize tracking points.")
 
-# Lucas-Kanade parameters
-lk_params = dict(winSize=(15, 15),
-                 maxLevel=2,
-                 criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
-
-# Feature detection parameters (Shi-Tomasi corner detector)
-feature_params = dict(maxCorners=100,
-                      qualityLevel=0.3,
-                      minDistance=7,
-                      blockSize=7)
-
-# Tracks state
-old_gray = None
-p0 = None
-mask = None
+# Lucas-Kanade parameters: winSize=15x15, maxLevel=2 (pyramid levels)
+# Feature detection parameters (Shi-Tomasi corner detector): qualityLevel, minDistance, blockSize
+# max_tracks: the tracker keeps about this many tracks, spread over a 5x4 grid
+# fb_threshold: largest forward-backward error (pixels) of a good track
+tracker = TrackManager(max_tracks=100, cols=5, rows=4, fb_threshold=1.0,
+                       winSize=15, maxLevel=2,
+                       qualityLevel=0.3, minDistance=7, blockSize=7)
 
 try:
     while True:
-        # Capture frame
-        frame = cam.pc2.capture_array()
-
-        # FIX: Check if frame has 4 channels (RGBA/BGRA) and convert to 3 channels (BGR)
-        if frame.shape[2] == 4:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+        # Get the newest captured frame
+        frame = source.read()
 
         frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
-        # Initialize if first run or requested
-        if p0 is None:
-            p0 = cv2.goodFeaturesToTrack(frame_gray, mask=None, **feature_params)
-            old_gray = frame_gray.copy()
-            # Create a mask image for drawing purposes
-            mask = np.zeros_like(frame)
-            
-        # Calculate Optical Flow
-        if p0 is not None and len(p0) > 0:
-            p1, st, err = cv2.calcOpticalFlowPyrLK(old_gray, frame_gray, p0, None, **lk_params)
+        # Track the points into this frame, drop bad tracks, re-seed empty cells
+        # (frame_gray is a new array every frame, so the tracker keeps it without a copy)
+        tracker.update(frame_gray, copy=False)
 
-            # Select good points (st==1 means flow found)
-            if p1 is not None:
-                good_new = p1[st == 1]
-                good_old = p0[st == 1]
-
-                # Draw the tracks
-                for i, (new, old) in enumerate(zip(good_new, good_old)):
-                    a, b = new.ravel()
-                    c, d = old.ravel()
-                    # Draw line on mask (persistent)
-                    mask = cv2.line(mask, (int(a), int(b)), (int(c), int(d)), (0, 255, 0), 2)
-                    # Draw point on current frame
-                    frame = cv2.circle(frame, (int(a), int(b)), 5, (0, 0, 255), -1)
-
-                # Overlay mask on frame
-                img = cv2.add(frame, mask)
-
-                # Update the previous frame and previous points
-                old_gray = frame_gray.copy()
-                p0 = good_new.reshape(-1, 1, 2)
-            else:
-                img = frame
-                p0 = None # Lost all points
-        else:
-            img = frame
+        # Draw the trail and the current position of every track
+        img = tracker.draw(frame)
 
         # Add info text
-        cv2.putText(img, f"Tracks: {len(p0) if p0 is not None else 0} (Press 'r' to reset)", (10, 30), 
+        stats = tracker.stats()
+        cv2.putText(img, f"Tracks: {stats['tracks']} (Press 'r' to reset)", (10, 30),
                     cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+        cv2.putText(img, f"Born: {stats['born']}  Dropped by fb check: {stats['fb_rejected']}", (10, 65),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
 
         # Display
         cv2.imshow("Optical Flow (Lucas-Kanade)", img)
@@ -92,8 +61,7 @@ try:
         if k == ord('q'):
             break
         elif k == ord('r'):
-            p0 = None
-            mask = np.zeros_like(frame)
+            tracker.reset()
 
 except KeyboardInterrupt:
     pass
@@ -101,4 +69,4 @@ except Exception as e:
     print(f"An error occurred: {e}")
 finally:
     cv2.destroyAllWindows()
-
+    source.stop()
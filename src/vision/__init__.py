@@ -0,0 +1,5 @@
+'''
+Shared helpers for the lecture scripts in src/.
+The lecture scripts import from this package (run them from the src/ folder, as VS Code does),
+and the tools in here can also be used on a machine without a camera.
+'''
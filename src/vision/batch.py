@@ -0,0 +1,335 @@
+'''
+Batch Processing of Recorded Footage
+The lecture scripts (and the runner) process one frame at a time, with a few Python calls
+per frame. For offline reprocessing of a whole recording it is cheaper to treat many frames
+as ONE array:
+
+    (N, H, W, C) batch  --reshape (no copy)-->  (N*H, W, C) "tall image"
+
+A per-pixel operation does not care where one frame ends and the next begins, so grayscale
+(01), the contrast / brightness lookup table (02, 03) and a fixed threshold (06) each become a
+single OpenCV call over the whole batch. Per-frame automatic thresholds (Otsu) are vectorised
+too: one cv2.calcHist per frame, then the thresholds of all frames are computed at once (segmentation.otsu_threshold accepts a stack of histograms).
+
+Stages that look at neighbourhoods (bilateral, median, Canny, ...) cannot be batched that way.
+map_stage() runs them on a pool of worker PROCESSES instead: each worker creates the stage
+once and processes a chunk of frames. For a recording or a memory-mapped .npy file the
+workers open the file themselves and only receive frame numbers, so the frames are never
+pickled on the way in.
+
+Memory stays bounded: the frames are read in chunks of chunk_frames, at most two chunks per
+worker are in flight, and the results are written into `out` - which can be a memory-mapped
+file (open_output) when the result does not fit into RAM.
+
+Measured on x86 (1 core, python -m vision.batch, grayscale + contrast + Otsu from the full
+histogram, results kept; the runs vary by ~20% on a shared machine):
+    320x240:   0.19-0.28 ms/frame per frame  ->  0.22-0.26 ms/frame as a batch
+    1280x720:  1.8-2.1 ms/frame per frame    ->  1.7-2.1 ms/frame as a batch (no gain)
+Batching removes the per-call overhead, which only matters for small frames (and there the
+full-resolution histograms eat most of it): at 720p the operations are limited by memory
+bandwidth either way. The process pool needs more than one
+core to pay off (with one core, bilateral is ~25% slower because of the extra processes).
+
+Usage:
+    recording = Recording("clip.raw")
+    gray = process(recording, [("grayscale", {}), ("contrast", {"alpha": 1.5}), ("threshold", {"mode": "otsu"})])
+    edges = map_stage(recording, "canny", {"threshold1": 50}, out=open_output("edges.npy", ...))
+
+    python -m vision.batch --frames 120 --width 1280 --height 720
+'''
+
+import argparse
+import json
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from vision.recording import Recording
+from vision.segmentation import otsu_threshold
+from vision.tone import ToneMapper
+
+
+# --- Sources -------------------------------------------------------------------------------
+
+def frame_count(source):
+    return len(source)
+
+
+def first_frame(source):
+    return source[0]
+
+
+def iter_chunks(source, chunk_frames=32):
+    '''
+    Yields (start, chunk) with chunk an (n, H, W[, C]) array. Array sources (including
+    np.memmap / np.load(mmap_mode="r")) are sliced without copying; the frames of a Recording
+    are copied into one reused chunk buffer.
+    '''
+    n = frame_count(source)
+    if isinstance(source, np.ndarray):
+        for start in range(0, n, chunk_frames):
+            yield start, source[start:start + chunk_frames]
+        return
+
+    shape = first_frame(source).shape
+    buffer = np.empty((chunk_frames,) + shape, dtype=first_frame(source).dtype)
+    for start in range(0, n, chunk_frames):
+        stop = min(start + chunk_frames, n)
+        for i in range(start, stop):
+            buffer[i - start] = source[i]
+        yield start, buffer[:stop - start]
+
+
+def open_output(path, shape, dtype=np.uint8):
+    '''A memory-mapped .npy file for results that do not fit into RAM.'''
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=tuple(shape))
+
+
+# --- Vectorised per-pixel operations -------------------------------------------------------
+# Each takes a batch (N, H, W[, C]) and writes into out (same number of frames).
+
+def _tall(batch):
+    '''View of a batch as one tall image (N*H, W[, C]) - no copy for contiguous batches.'''
+    n, h = batch.shape[:2]
+    return np.ascontiguousarray(batch).reshape((n * h,) + batch.shape[2:])
+
+
+def batch_grayscale(batch, out=None):
+    '''01_grayscale.py for a batch of BGR frames.'''
+    if batch.ndim == 3:
+        if out is None:
+            return batch
+        np.copyto(out, batch)
+        return out
+    if out is None:
+        out = np.empty(batch.shape[:3], dtype=np.uint8)
+    cv2.cvtColor(_tall(batch), cv2.COLOR_BGR2GRAY, dst=_tall(out))
+    return out
+
+
+def batch_tone(batch, alpha=1.0, beta=0.0, gamma=1.0, out=None):
+    '''02_contrast.py / 03_brightness.py: one table (or convertScaleAbs) pass over the batch.'''
+    if out is None:
+        out = np.empty_like(batch)
+    ToneMapper(alpha, beta, gamma).apply(_tall(batch), dst=_tall(out))
+    return out
+
+
+def batch_threshold(batch, thresh=127, mode="fixed", step=1, out=None):
+    '''
+    06_thresholding.py for a batch of grayscale frames. mode "otsu" computes one threshold per
+    frame from its histogram (the same threshold as cv2.THRESH_OTSU); step > 1 counts only
+    every step-th pixel in both directions, like the threshold stage's step (faster, the
+    thresholds are then approximate). Returns (mask batch, thresholds).
+    '''
+    n = batch.shape[0]
+    if out is None:
+        out = np.empty(batch.shape, dtype=np.uint8)
+    if mode == "fixed":
+        cv2.threshold(_tall(batch), thresh, 255, cv2.THRESH_BINARY, dst=_tall(out))
+        return out, np.full(n, thresh)
+    if mode != "otsu":
+        raise ValueError("mode must be 'fixed' or 'otsu'")
+
+    # One histogram per frame, then the Otsu thresholds of all frames at once
+    hists = np.empty((n, 256), dtype=np.float32)
+    for i in range(n):
+        hists[i] = cv2.calcHist([batch[i, ::step, ::step]], [0], None, [256], [0, 256]).ravel()
+    thresholds = otsu_threshold(hists)
+
+    # The mask itself: one cv2.threshold per frame. A broadcast np.greater over the batch is
+    # ~8x slower than OpenCV's SIMD threshold, the loop costs only n Python calls.
+    for i in range(n):
+        cv2.threshold(batch[i], int(thresholds[i]), 255, cv2.THRESH_BINARY, dst=out[i])
+    return out, thresholds
+
+
+def _tone_params(name, params):
+    '''contrast / brightness use the defaults of their stages (stages.py).'''
+    defaults = {"contrast": {"alpha": 2.0, "beta": 0}, "brightness": {"alpha": 1.0, "beta": 50}}[name]
+    return {**defaults, **params}
+
+
+def _temporary(buffers, key, shape):
+    buf = buffers.get(key)
+    if buf is None or buf.shape != tuple(shape):
+        buf = np.empty(shape, dtype=np.uint8)
+        buffers[key] = buf
+    return buf
+
+
+def apply_ops(batch, ops, out=None, buffers=None):
+    '''
+    Applies a list of (name, params) per-pixel operations to one batch; returns the result.
+    The last operation writes into out (if given), the others into temporary batches that are
+    kept in buffers between calls (allocating ~30 MB per chunk costs more page faults than
+    the operations themselves).
+    '''
+    buffers = {} if buffers is None else buffers
+    for k, (name, params) in enumerate(ops):
+        shape = batch.shape[:3] if name in ("grayscale", "threshold") else batch.shape
+        dst = out if k == len(ops) - 1 and out is not None else _temporary(buffers, k, shape)
+        if name == "grayscale":
+            batch = batch_grayscale(batch, out=dst)
+        elif name in ("contrast", "brightness"):
+            batch = batch_tone(batch, **_tone_params(name, params), out=dst)
+        elif name == "threshold":
+            if batch.ndim == 4:
+                batch = batch_grayscale(batch, out=_temporary(buffers, "gray", shape))
+            batch = batch_threshold(batch, **params, out=dst)[0]
+        else:
+            raise ValueError(f"{name!r} is not a per-pixel batch operation (use map_stage)")
+    return batch
+
+
+def process(source, ops, out=None, chunk_frames=32):
+    '''
+    Runs per-pixel operations over a whole source (array or Recording) chunk by chunk.
+    ops: list of (name, params) with name grayscale, contrast, brightness or threshold.
+    Otsu thresholds come from the full histogram of every frame unless the threshold params
+    give a step (see batch_threshold); the threshold stage itself subsamples (step=4) and
+    reuses a threshold for reuse_frames frames, so its masks can differ slightly.
+    '''
+    n = frame_count(source)
+    buffers = {}
+    for start, chunk in iter_chunks(source, chunk_frames):
+        if out is None:
+            # The first chunk tells the output shape and type
+            result = apply_ops(chunk, ops, buffers=buffers)
+            out = np.empty((n,) + result.shape[1:], dtype=result.dtype)
+            out[:len(result)] = result
+        else:
+            # Later chunks are written straight into their slice of out
+            apply_ops(chunk, ops, out=out[start:start + len(chunk)], buffers=buffers)
+    return out
+
+
+# --- Process pool for neighbourhood (OpenCV-bound) stages ----------------------------------
+
+_worker = {}
+
+
+def _init_worker(stage_name, params, source_spec):
+    from vision.stages import create_stage
+    _worker["stage"] = create_stage(stage_name, **params)
+    _worker["source"] = _open_spec(source_spec) if source_spec is not None else None
+
+
+def _source_spec(source):
+    '''How a worker can open the source itself (None: the frames have to be sent).'''
+    if isinstance(source, Recording):
+        return ("recording", source.path)
+    if isinstance(source, np.memmap) and isinstance(source.base, mmap.mmap) and source.flags.c_contiguous:
+        return ("memmap", source.filename, source.offset, source.shape, source.dtype.str)
+    return None
+
+
+def _open_spec(spec):
+    if spec[0] == "recording":
+        return Recording(spec[1])
+    _, filename, offset, shape, dtype = spec
+    return np.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+
+def _run_chunk(task):
+    start, frames = task
+    if isinstance(frames, range):
+        frames = (_worker["source"][i] for i in frames)
+    stage = _worker["stage"]
+    # The stage reuses its output buffer, so every result is copied into the chunk result
+    results = [stage.process(frame).copy() for frame in frames]
+    return start, np.stack(results)
+
+
+def map_stage(source, stage_name, params=None, workers=None, chunk_frames=8, out=None):
+    '''
+    Runs a registered stage (stages.py) on every frame of source with a pool of worker
+    processes. Stateful stages (optical flow, background) only see the frames of their own
+    chunks, so use them with workers=1.
+    '''
+    params = params or {}
+    workers = workers or os.cpu_count() or 1
+    n = frame_count(source)
+    spec = _source_spec(source)
+
+    def tasks():
+        if spec is not None:
+            for start in range(0, n, chunk_frames):
+                yield start, range(start, min(start + chunk_frames, n))
+        else:
+            for start, chunk in iter_chunks(source, chunk_frames):
+                yield start, np.array(chunk)        # own copy, the chunk buffer is reused
+
+    def store(start, result):
+        nonlocal out
+        if out is None:
+            out = np.empty((n,) + result.shape[1:], dtype=result.dtype)
+        out[start:start + len(result)] = result
+
+    if workers == 1:
+        _init_worker(stage_name, params, spec)
+        for task in tasks():
+            store(*_run_chunk(task))
+        return out
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(stage_name, params, spec)) as pool:
+        pending = []
+        for task in tasks():
+            pending.append(pool.submit(_run_chunk, task))
+            # At most two chunks per worker in flight, so memory does not grow with the recording
+            if len(pending) >= 2 * workers:
+                store(*pending.pop(0).result())
+        for future in pending:
+            store(*future.result())
+    return out
+
+
+def main():
+    from vision.bench import synthetic_frames
+    from vision.stages import create_stage
+
+    parser = argparse.ArgumentParser(description="Compare batch processing with a per-frame loop")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--chunk", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    frames = np.stack(synthetic_frames(args.width, args.height, 8))
+    batch = frames[np.arange(args.frames) % len(frames)]
+    ops = [("grayscale", {}), ("contrast", {"alpha": 1.5, "beta": 10}), ("threshold", {"mode": "otsu"})]
+
+    stored = np.empty(batch.shape[:3], dtype=np.uint8)
+
+    def per_frame():
+        # The same work as process(): every result is kept (copied into stored)
+        stages = [create_stage("grayscale"), create_stage("contrast", alpha=1.5, beta=10),
+                  create_stage("threshold", mode="otsu", step=1, reuse_frames=1)]
+        for i, frame in enumerate(batch):
+            for stage in stages:
+                frame = stage.process(frame)
+            stored[i] = frame
+
+    report = {}
+    for name, fn in (("per-pixel ops, per frame", per_frame),
+                     ("per-pixel ops, batch", lambda: process(batch, ops, out=stored, chunk_frames=args.chunk)),
+                     ("bilateral, 1 process", lambda: map_stage(batch[:16], "bilateral", workers=1)),
+                     ("bilateral, pool", lambda: map_stage(batch[:16], "bilateral", workers=args.workers))):
+        elapsed = float("inf")
+        for _ in range(3):                  # best of three, the first run pays for page faults
+            start = time.perf_counter()
+            fn()
+            elapsed = min(elapsed, time.perf_counter() - start)
+        count = 16 if name.startswith("bilateral") else args.frames
+        report[name] = {"ms_per_frame": round(1000 * elapsed / count, 3)}
+    report["workers"] = args.workers or os.cpu_count()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+'''
+Benchmark Suite
+Runs every lecture operation headless on synthetic (or recorded) frames at several resolutions
+and reports latency percentiles, frames per second and peak memory as JSON.
+Use it to spot performance regressions and to size hardware (e.g. how expensive is the
+bilateral filter from 09_remove_noise.py on a Raspberry Pi 5 at 1080p?).
+
+Usage (from src/):
+    python -m vision.bench
+    python -m vision.bench --ops bilateral,canny --resolutions 640x480,1920x1080 --output bench.json
+    python -m vision.bench --source file:my_video.mp4
+    python -m vision.bench --source replay:clip.raw      (recording made with vision/recording.py)
+
+Results per operation and resolution:
+    p50_ms, p95_ms, p99_ms  latency percentiles per frame
+    fps                     frames per second (1000 / mean latency)
+    peak_memory_bytes       peak extra memory allocated while processing, including the
+                            buffers a stage keeps between frames (tracemalloc)
+'''
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from vision.recording import Recording
+from vision.stages import create_stage
+
+RESOLUTIONS = ((320, 240), (640, 480), (1280, 720), (1920, 1080))
+
+# Operation name -> (stage name, stage parameters, input kind)
+# Input kind: "bgr" colour frames, "gray" grayscale frames, "binary" thresholded frames
+OPERATIONS = {
+    "contrast": ("contrast", {}, "bgr"),
+    "brightness": ("brightness", {}, "bgr"),
+    "histogram": ("histogram", {}, "bgr"),
+    "stretching": ("stretch", {}, "gray"),
+    "threshold": ("threshold", {}, "gray"),
+    "mog2": ("background", {}, "bgr"),
+    "gaussian": ("blur", {}, "bgr"),
+    "bilateral": ("bilateral", {}, "bgr"),
+    "canny": ("canny", {}, "gray"),
+    "box": ("mean", {}, "bgr"),
+    "median": ("median", {}, "bgr"),
+    "dilate": ("dilate", {}, "binary"),
+    "erode": ("erode", {}, "binary"),
+    "orb": ("orb", {}, "gray"),
+    "forward_warp": ("forward_warp", {}, "bgr"),
+    "backward_warp": ("backward_warp", {}, "bgr"),
+    "lk_flow": ("optical_flow", {}, "gray"),
+}
+
+
+def synthetic_frames(width, height, count, seed=0):
+    '''
+    A short synthetic video: a smooth random texture (so corner and feature detectors find
+    something) that slowly pans, plus a moving bright square and a little sensor noise.
+    '''
+    rng = np.random.default_rng(seed)
+    pad = 2 * count
+    texture = rng.integers(0, 256, (height + pad, width + pad, 3), dtype=np.uint8)
+    texture = cv2.GaussianBlur(texture, (0, 0), 3)
+    texture = cv2.normalize(texture, None, 0, 255, cv2.NORM_MINMAX)
+
+    frames = []
+    size = max(height // 6, 1)
+    for i in range(count):
+        frame = texture[i:i + height, 2 * i:2 * i + width].copy()
+        x = (i * 8) % max(width - size, 1)
+        cv2.rectangle(frame, (x, height // 3), (x + size, height // 3 + size), (255, 255, 255), -1)
+        noise = rng.integers(-8, 9, frame.shape, dtype=np.int16)
+        frames.append(np.clip(frame + noise, 0, 255).astype(np.uint8))
+    return frames
+
+
+def recorded_frames(spec, width, height, count):
+    '''
+    Up to count frames from a video file ("file:PATH") or a raw recording ("replay:PATH",
+    see recording.py), resized to width x height.
+    '''
+    kind, _, path = spec.partition(":")
+    frames = []
+    if kind == "replay":
+        recording = Recording(path)
+        for i in range(min(count, len(recording))):
+            frame = recording[i]
+            if frame.ndim == 2:
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            frames.append(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA))
+        recording.close()
+    else:
+        cap = cv2.VideoCapture(path)
+        while len(frames) < count:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA))
+        cap.release()
+    if not frames:
+        raise IOError(f"Could not read frames from {path}")
+    return frames
+
+
+def prepare_inputs(frames, kind):
+    if kind == "bgr":
+        return frames
+    gray = [cv2.cvtColor(f, cv2.COLOR_BGR2GRAY) for f in frames]
+    if kind == "gray":
+        return gray
+    return [cv2.threshold(g, 127, 255, cv2.THRESH_BINARY)[1] for g in gray]
+
+
+def latency_stats(times):
+    '''Latency summary (in milliseconds) of a list of durations in seconds.'''
+    ms = np.asarray(times) * 1000.0
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "fps": round(1000.0 / float(np.mean(ms)), 1) if np.mean(ms) > 0 else None,
+    }
+
+
+def time_calls(fn, inputs, repeat, warmup=3):
+    '''Calls fn on the inputs (cycling through them) and returns the durations in seconds.'''
+    for i in range(warmup):
+        fn(inputs[i % len(inputs)])
+
+    times = []
+    for i in range(repeat):
+        frame = inputs[i % len(inputs)]
+        start = time.perf_counter()
+        fn(frame)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def peak_memory(fn, inputs, calls=5):
+    '''Peak extra memory (bytes) allocated while calling fn, measured with tracemalloc.'''
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    for i in range(calls):
+        fn(inputs[i % len(inputs)])
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return int(peak)
+
+
+def benchmark_operation(name, frames, repeat):
+    stage_name, params, kind = OPERATIONS[name]
+    inputs = prepare_inputs(frames, kind)
+
+    # A fresh stage for every run, so stateful stages (MOG2, optical flow) start from scratch
+    stage = create_stage(stage_name, **params)
+    result = latency_stats(time_calls(stage.process, inputs, repeat))
+    result["peak_memory_bytes"] = peak_memory(create_stage(stage_name, **params).process, inputs)
+    return result
+
+
+def run(ops, resolutions, frame_count, repeat, source="synthetic"):
+    report = {
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "opencv_threads": cv2.getNumThreads(),
+        "repeat": repeat,
+        "results": {},
+    }
+
+    for width, height in resolutions:
+        if source == "synthetic":
+            frames = synthetic_frames(width, height, frame_count)
+        else:
+            frames = recorded_frames(source, width, height, frame_count)
+
+        resolution = f"{width}x{height}"
+        for name in ops:
+            result = benchmark_operation(name, frames, repeat)
+            report["results"].setdefault(name, {})[resolution] = result
+            print(f"{name:15s} {resolution:>10s}  p50 {result['p50_ms']:9.3f} ms  "
+                  f"{result['fps']:8.1f} FPS", file=sys.stderr, flush=True)
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the lecture operations headless")
+    parser.add_argument("--ops", default=",".join(OPERATIONS),
+                        help="comma separated operations (default: all)")
+    parser.add_argument("--resolutions", default=",".join(f"{w}x{h}" for w, h in RESOLUTIONS),
+                        help="comma separated WIDTHxHEIGHT list")
+    parser.add_argument("--frames", type=int, default=20, help="number of distinct input frames")
+    parser.add_argument("--repeat", type=int, default=50, help="timed calls per operation")
+    parser.add_argument("--source", default="synthetic", help="synthetic, file:PATH or replay:PATH")
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    ops = args.ops.split(",")
+    unknown = [op for op in ops if op not in OPERATIONS]
+    if unknown:
+        parser.error(f"unknown operations: {', '.join(unknown)}")
+    resolutions = [tuple(int(v) for v in r.split("x")) for r in args.resolutions.split(",")]
+
+    report = run(ops, resolutions, args.frames, args.repeat, args.source)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"Report written to {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+'''
+Ingest Benchmark
+Compares the ingest path of the lecture scripts before and after vision/ingest.py:
+
+    current: frame = capture_array()                  (new array every frame)
+             frame = cv2.cvtColor(frame, RGBA2BGR)    (another new array every frame)
+             gray  = cv2.cvtColor(frame, BGR2GRAY)    (grayscale scripts only)
+    ingest:  camera delivers the needed format, Ingest.convert(raw, dst) writes into a reused buffer
+    view:    grayscale from YUV420 as a zero-copy view of the Y plane (Ingest.view)
+
+Reports the latency per frame and the bytes allocated per frame (peak measured with tracemalloc,
+which also sees NumPy and OpenCV output arrays). Runs without a camera on synthetic frames.
+
+Usage (from src/):
+    python -m vision.bench_ingest --width 1920 --height 1080
+'''
+
+import argparse
+import json
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from vision.ingest import BGR888, GRAY, Ingest, frame_shape, synthetic_yuv420
+
+
+def make_raw_frames(width, height):
+    '''Synthetic raw frames in the layouts the camera can deliver.'''
+    rng = np.random.default_rng(0)
+    rgba = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    bgr = np.ascontiguousarray(rgba[:, :, :3])
+    # Camera YUV420 rows are padded to a multiple of 64 bytes
+    yuv420 = synthetic_yuv420(width, height, stride=(width + 63) // 64 * 64)
+    return {"RGBA": rgba, "RGB888": bgr, "YUV420": yuv420}
+
+
+def current_bgr(raw):
+    frame = raw.copy()  # capture_array() hands out a fresh copy of the camera buffer
+    if frame.shape[2] == 4:
+        frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+    return frame
+
+
+def current_gray(raw):
+    return cv2.cvtColor(current_bgr(raw), cv2.COLOR_BGR2GRAY)
+
+
+def measure(fn, iterations):
+    '''Returns (median latency in ms, bytes allocated per frame).'''
+    fn()  # warm up
+
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    allocated = []
+    for _ in range(min(iterations, 10)):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        fn()
+        allocated.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    return float(np.median(times)) * 1000.0, int(np.median(allocated))
+
+
+def run(width, height, iterations):
+    raw = make_raw_frames(width, height)
+    bgr_dst = np.empty(frame_shape(BGR888, height, width), np.uint8)
+    gray_dst = np.empty(frame_shape(GRAY, height, width), np.uint8)
+    to_bgr = Ingest(BGR888)
+    to_gray = Ingest(GRAY)
+
+    cases = {
+        "bgr/current (RGBA capture_array + cvtColor)": lambda: current_bgr(raw["RGBA"]),
+        "bgr/ingest (RGBA -> dst)": lambda: to_bgr.convert(raw["RGBA"], bgr_dst),
+        "bgr/ingest (RGB888 -> dst)": lambda: to_bgr.convert(raw["RGB888"], bgr_dst),
+        "gray/current (RGBA capture_array + 2x cvtColor)": lambda: current_gray(raw["RGBA"]),
+        "gray/ingest (RGBA -> dst)": lambda: to_gray.convert(raw["RGBA"], gray_dst),
+        "gray/ingest (YUV420 -> dst)": lambda: to_gray.convert(raw["YUV420"], gray_dst),
+        "gray/view (YUV420 luma plane, zero-copy)": lambda: to_gray.view(raw["YUV420"], height, width),
+    }
+
+    results = {}
+    for name, fn in cases.items():
+        latency_ms, allocated = measure(fn, iterations)
+        results[name] = {"latency_ms": round(latency_ms, 3), "bytes_allocated_per_frame": allocated}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the frame ingest path")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--iterations", type=int, default=100)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.width, args.height, args.iterations), indent=2))
@@ -0,0 +1,26 @@
+'''
+Bit Counting
+Packed binary data (ORB descriptors in matching.py, bit-packed masks in morphology.py) is
+stored as uint64 words, and both need the number of set bits of every word. NumPy >= 2.0 has
+np.bitwise_count for that. Older versions count the bits with a 65536-entry lookup table over
+the four 16-bit halves of every word instead (POPCOUNT16, built from the 256-entry POPCOUNT8).
+
+Usage:
+    popcount(words)                       # uint8 array, same shape as words (uint64)
+'''
+
+import numpy as np
+
+# Number of set bits of every byte value, and of every 16-bit value (built from the byte table)
+POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+POPCOUNT16 = (POPCOUNT8[:, None] + POPCOUNT8[None, :]).ravel()
+
+HAS_BITWISE_COUNT = hasattr(np, "bitwise_count")
+
+
+def popcount(words):
+    '''Set bits of every element of a uint64 array (np.bitwise_count or the 16-bit table).'''
+    if HAS_BITWISE_COUNT:
+        return np.bitwise_count(words)
+    halves = words.view(np.uint16).reshape(words.shape + (4,))
+    return POPCOUNT16[halves].sum(axis=-1, dtype=np.uint8)
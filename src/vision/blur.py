@@ -0,0 +1,245 @@
+'''
+Gaussian Blur Engine
+A 2D Gaussian kernel of size k x k costs k*k multiplications per pixel when applied directly.
+For big blurs there are much cheaper ways to get (almost) the same result:
+
+    "opencv"     cv2.GaussianBlur (OpenCV already splits the kernel into a row and a column pass)
+    "separable"  the same idea written out: a cached 1D kernel, applied to the rows and then the
+                 columns with cv2.sepFilter2D - 2*k instead of k*k multiplications per pixel
+    "pyramid"    shrink the image with cv2.pyrDown (every level halves the size and blurs a bit),
+                 blur the small image with a much smaller kernel and scale it back up.
+                 Work drops by 4x per level, the result is a close approximation.
+    "recursive"  Young - van Vliet recursive (IIR) Gaussian: every pixel is computed from the
+                 input and the last 3 OUTPUT pixels, in a forward and a backward pass per direction.
+                 The cost does NOT depend on sigma, but the recursion runs row by row in NumPy,
+                 so it is only a reference here (a C implementation would be much faster).
+
+GaussianBlurEngine(method="auto") picks the method with the measured crossover point below.
+error_report() compares every method against cv2.GaussianBlur.
+
+Usage:
+    engine = GaussianBlurEngine(ksize=61)      # or sigma=10 (ksize 0 = computed from sigma)
+    blurred = engine.apply(frame)
+    print(engine.method)
+
+    python -m vision.blur --width 1920 --height 1080 --sigmas 2,5,10,20,40
+'''
+
+import argparse
+import json
+import math
+
+import cv2
+import numpy as np
+
+METHODS = ("opencv", "separable", "pyramid", "recursive")
+
+# Crossover point of "auto" (sigma in pixels), measured at 1080p on x86 with python -m vision.blur:
+# below it the explicit separable passes were the fastest (with at most 1 gray level error),
+# above it the pyramid (~10 ms at any sigma, a few gray levels error on sharp edges).
+PYRAMID_MIN_SIGMA = 8.0
+
+_kernel_cache = {}
+
+
+def sigma_for_ksize(ksize):
+    '''The sigma cv2.GaussianBlur uses when sigma is 0.'''
+    return 0.3 * ((ksize - 1) * 0.5 - 1) + 0.8
+
+
+def ksize_for_sigma(sigma):
+    '''The kernel size cv2.GaussianBlur uses for 8-bit images when ksize is 0.'''
+    return int(round(sigma * 3 * 2 + 1)) | 1
+
+
+def gaussian_kernel(ksize, sigma):
+    '''1D Gaussian kernel (float32, sums to 1), cached per (ksize, sigma).'''
+    key = (ksize, sigma)
+    kernel = _kernel_cache.get(key)
+    if kernel is None:
+        kernel = _kernel_cache[key] = cv2.getGaussianKernel(ksize, sigma, cv2.CV_32F)
+    return kernel
+
+
+def young_van_vliet(sigma):
+    '''Coefficients (B, b1, b2, b3) of the recursive Gaussian (Young and van Vliet, 1995).'''
+    if sigma >= 2.5:
+        q = 0.98711 * sigma - 0.96330
+    else:
+        q = 3.97156 - 4.14554 * math.sqrt(1 - 0.26891 * max(sigma, 0.5))
+    b0 = 1.57825 + 2.44413 * q + 1.4281 * q ** 2 + 0.422205 * q ** 3
+    b1 = (2.44413 * q + 2.85619 * q ** 2 + 1.26661 * q ** 3) / b0
+    b2 = -(1.4281 * q ** 2 + 1.26661 * q ** 3) / b0
+    b3 = (0.422205 * q ** 3) / b0
+    return 1.0 - (b1 + b2 + b3), b1, b2, b3
+
+
+def _recursive_rows(data, coeffs):
+    '''
+    Forward and backward recursion down the rows of data (float32, modified in place).
+    Every step works on a whole row at once, so the Python loop runs once per row.
+    Before the first row the signal is taken as constant (the caller pads the image first).
+    '''
+    B, b1, b2, b3 = coeffs
+    n = data.shape[0]
+    tmp = np.empty_like(data[0])
+
+    # Forward: w[i] = B*x[i] + b1*w[i-1] + b2*w[i-2] + b3*w[i-3]
+    w1 = w2 = w3 = data[0].copy()
+    for i in range(n):
+        row = data[i]
+        np.multiply(row, B, out=row)
+        np.multiply(w1, b1, out=tmp); row += tmp
+        np.multiply(w2, b2, out=tmp); row += tmp
+        np.multiply(w3, b3, out=tmp); row += tmp
+        w1, w2, w3 = row, w1, w2
+
+    # Backward: y[i] = B*w[i] + b1*y[i+1] + b2*y[i+2] + b3*y[i+3]
+    y1 = y2 = y3 = data[n - 1].copy()
+    for i in range(n - 1, -1, -1):
+        row = data[i]
+        np.multiply(row, B, out=row)
+        np.multiply(y1, b1, out=tmp); row += tmp
+        np.multiply(y2, b2, out=tmp); row += tmp
+        np.multiply(y3, b3, out=tmp); row += tmp
+        y1, y2, y3 = row, y1, y2
+    return data
+
+
+class GaussianBlurEngine:
+
+    def __init__(self, ksize=15, sigma=0.0, method="auto"):
+        '''
+        ksize   kernel size like cv2.GaussianBlur (odd, 0 = computed from sigma)
+        sigma   standard deviation (0 = computed from ksize)
+        method  "auto" or one of METHODS
+        '''
+        if ksize <= 0 and sigma <= 0:
+            raise ValueError("Give a kernel size or a sigma")
+        if ksize > 0 and ksize % 2 == 0:
+            raise ValueError("ksize must be odd")
+        if method != "auto" and method not in METHODS:
+            raise ValueError(f"method must be 'auto' or one of {METHODS}")
+
+        self.sigma = sigma if sigma > 0 else sigma_for_ksize(ksize)
+        self.ksize = ksize if ksize > 0 else ksize_for_sigma(self.sigma)
+        self.method = self.choose(self.sigma) if method == "auto" else method
+        self.buffers = {}
+
+    @staticmethod
+    def choose(sigma):
+        '''
+        The cheapest method for a sigma. "recursive" is never picked: its cost is constant
+        (~150 ms at 1080p in NumPy) but the pyramid was faster at every sigma we measured.
+        '''
+        if sigma >= PYRAMID_MIN_SIGMA:
+            return "pyramid"
+        return "separable"
+
+    def _buffer(self, key, shape, dtype=np.uint8):
+        buf = self.buffers.get(key)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self.buffers[key] = buf
+        return buf
+
+    def apply(self, frame, dst=None):
+        if dst is None:
+            dst = self._buffer("out", frame.shape)
+        if self.method == "opencv":
+            return cv2.GaussianBlur(frame, (self.ksize, self.ksize), self.sigma, dst=dst)
+        if self.method == "separable":
+            kernel = gaussian_kernel(self.ksize, self.sigma)
+            return cv2.sepFilter2D(frame, -1, kernel, kernel, dst=dst)
+        if self.method == "pyramid":
+            return self._pyramid(frame, dst)
+        return self._recursive(frame, dst)
+
+    def _pyramid(self, frame, dst):
+        # Every pyrDown level blurs with sigma 1 (at its own scale) before halving the size.
+        # Go down while the blur still left over is at least 2 pixels at the smaller scale.
+        levels = 0
+        variance_done = 0.0                              # blur done so far, in original pixels^2
+        while True:
+            scale = 2 ** (levels + 1)
+            next_variance = variance_done + (scale / 2) ** 2
+            if (self.sigma ** 2 - next_variance) / scale ** 2 < 2.0 ** 2:
+                break
+            variance_done = next_variance
+            levels += 1
+            if min(frame.shape[:2]) // scale < 8:
+                break
+
+        small = frame
+        for i in range(levels):
+            h, w = small.shape[:2]
+            small = cv2.pyrDown(small, dst=self._buffer(f"down{i}", ((h + 1) // 2, (w + 1) // 2) + frame.shape[2:]))
+
+        scale = 2 ** levels
+        rest = math.sqrt(max(self.sigma ** 2 - variance_done, 0.0)) / scale
+        if rest > 0.1:
+            small = cv2.GaussianBlur(small, (0, 0), rest, dst=self._buffer("small", small.shape))
+        return cv2.resize(small, (frame.shape[1], frame.shape[0]), dst=dst, interpolation=cv2.INTER_LINEAR)
+
+    def _recursive(self, frame, dst):
+        coeffs = young_van_vliet(self.sigma)
+
+        # Mirror the border like cv2.GaussianBlur (BORDER_REFLECT_101) by 3 sigma, so the
+        # recursion has already "warmed up" when it reaches the real image
+        pad = min(int(math.ceil(3 * self.sigma)), frame.shape[0] - 1, frame.shape[1] - 1)
+        h, w = frame.shape[0] + 2 * pad, frame.shape[1] + 2 * pad
+        padded = cv2.copyMakeBorder(frame, pad, pad, pad, pad, cv2.BORDER_REFLECT_101,
+                                    dst=self._buffer("padded", (h, w) + frame.shape[2:]))
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+
+        # Vertical pass: rows are contiguous (w * channels values each)
+        data = self._buffer("float", (h, w * channels), np.float32)
+        np.copyto(data, padded.reshape(h, w * channels))
+        _recursive_rows(data, coeffs)
+
+        # Horizontal pass: transpose so that image columns become contiguous rows
+        columns = self._buffer("float_t", (w, h, channels), np.float32)
+        np.copyto(columns, data.reshape(h, w, channels).transpose(1, 0, 2))
+        _recursive_rows(columns.reshape(w, h * channels), coeffs)
+
+        result = columns.transpose(1, 0, 2)[pad:h - pad, pad:w - pad].reshape(frame.shape)
+        np.copyto(dst, np.clip(result + 0.5, 0, 255), casting="unsafe")
+        return dst
+
+
+def error_report(frame, ksize=0, sigma=10.0, methods=METHODS):
+    '''Difference of every method to cv2.GaussianBlur (in gray levels) for one frame.'''
+    reference = GaussianBlurEngine(ksize, sigma, method="opencv").apply(frame).astype(np.int16)
+    report = {}
+    for method in methods:
+        result = GaussianBlurEngine(ksize, sigma, method=method).apply(frame)
+        diff = np.abs(result.astype(np.int16) - reference)
+        report[method] = {"max_abs_error": int(diff.max()), "mean_abs_error": round(float(diff.mean()), 4)}
+    return report
+
+
+def main():
+    from vision.bench import latency_stats, synthetic_frames, time_calls
+
+    parser = argparse.ArgumentParser(description="Compare the Gaussian blur methods")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--sigmas", default="2,5,10,20,40", help="comma separated sigmas")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    frames = synthetic_frames(args.width, args.height, 3)
+    report = {}
+    for sigma in (float(s) for s in args.sigmas.split(",")):
+        errors = error_report(frames[0], sigma=sigma)
+        entry = {"auto": GaussianBlurEngine(sigma=sigma, ksize=0).method, "methods": {}}
+        for method in METHODS:
+            engine = GaussianBlurEngine(sigma=sigma, ksize=0, method=method)
+            entry["methods"][method] = latency_stats(time_calls(engine.apply, frames, args.repeat, warmup=1))
+            entry["methods"][method].update(errors[method])
+        report[f"sigma={sigma:g}"] = entry
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+'''
+Grid ORB (Feature Detection per Grid Cell, with a Keypoint Cache)
+15_ORB.py runs orb.detect over the whole frame with one budget of nfeatures. ORB keeps the
+keypoints with the strongest corner response, so on a frame with one strongly textured area
+nearly all of them end up there - useless for tracking or for estimating a homography, which
+need points spread over the whole image. And descriptors are never computed.
+
+Here the frame is split into a grid of cells and every cell gets its own budget:
+
+    +------+------+------+------+
+    | 500/ | 500/ | ...  |      |     every cell: detectAndCompute on the cell (+ halo)
+    |  12  |  12  |      |      |     -> at most nfeatures / cells keypoints AND descriptors
+    +------+------+------+------+
+    |      |      |      |      |
+    +------+------+------+------+
+
+*   The cells run on a thread pool (OpenCV releases the GIL, one ORB object per cell because
+    an ORB object is not meant to be shared between threads).
+*   Every cell is cut out with a halo of patch_size pixels, so keypoints near the inner cell
+    borders still have the image patch they need for the descriptor. Only keypoints inside
+    the cell itself are kept (no duplicates between neighbouring cells). The halo covers the
+    patch on pyramid level 0 only: on level l the patch reaches patch_size * scaleFactor^l
+    pixels, so near an inner cell border a coarse-scale keypoint can be missed (a halo that
+    large, ~110 pixels with the default 8 levels, would triple the area every cell detects on).
+    The grid is therefore close to, but not the same as, a full-frame ORB.
+*   Keypoints and descriptors of every cell are CACHED. A cell is detected again only when
+    its content changed: the frame is downscaled to block x block pixels per cell and a cell
+    counts as changed when any of its pixels differs by more than change_threshold from the
+    frame the cell was last detected on (so slow changes add up). Cells are refreshed after
+    max_age frames anyway.
+
+Measured at 1280x720 on the static test scene with one noisy, strongly textured corner
+(x86, 1 core, python -m vision.features):
+    full-frame ORB      89% of the keypoints in the textured corner cell, one cell empty
+    4x3 grid            at most 18% in one cell, no cell empty
+    detectAndCompute    full frame ~20 ms, grid without cache ~29-37 ms (twelve small
+                        pyramids plus the halos cost more than one big one - the thread pool
+                        wins that back only with several cores), grid with cache ~11 ms
+                        (~36% of the cells detected per frame while two objects move)
+
+Usage:
+    orb = GridOrb(nfeatures=500, cols=4, rows=3)
+    keypoints, descriptors = orb.detect_and_compute(gray)
+    print(orb.stats())
+
+    python -m vision.features --width 1280 --height 720
+'''
+
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+class GridOrb:
+
+    def __init__(self, nfeatures=500, cols=4, rows=3, threads=None, change_threshold=12, block=8,
+                 max_age=30, patch_size=31, **orb_params):
+        '''
+        nfeatures         total budget, every cell gets nfeatures / (cols * rows)
+        cols, rows        grid size
+        threads           threads of the pool (default: number of CPU cores, 1 = no pool)
+        change_threshold  gray level difference that marks a cell as changed (None: detect
+                          every cell every frame, no cache)
+        block             the change check compares block x block pixels per cell
+        max_age           frames after which a cell is detected again even if nothing changed
+        patch_size        ORB patch size, also used as the halo around every cell
+        orb_params        further cv2.ORB_create parameters (scaleFactor, nlevels, fastThreshold, ...)
+        '''
+        self.nfeatures = nfeatures
+        self.cols = cols
+        self.rows = rows
+        self.change_threshold = change_threshold
+        self.block = block
+        self.max_age = max_age
+        self.halo = patch_size
+        self.per_cell = max(1, nfeatures // (cols * rows))
+        edge_threshold = orb_params.pop("edgeThreshold", patch_size)
+        self.orbs = [cv2.ORB_create(nfeatures=self.per_cell, patchSize=patch_size, edgeThreshold=edge_threshold,
+                                    **orb_params)
+                     for _ in range(cols * rows)]
+        threads = threads or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="orb") if threads > 1 else None
+        self.buffers = {}
+        self.reset()
+
+    def _buffer(self, key, shape, dtype=np.uint8):
+        buf = self.buffers.get(key)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self.buffers[key] = buf
+        return buf
+
+    def reset(self):
+        '''Forgets all cached keypoints (the next frame detects every cell).'''
+        n = self.cols * self.rows
+        self.shape = None
+        self.cells = []                          # (x0, y0, x1, y1) per cell
+        self.cell_keypoints = [()] * n
+        self.cell_descriptors = [None] * n
+        self.age = np.zeros(n, dtype=np.int64)
+        self.reference = None                    # downscaled frame each cell was detected on
+        self.keypoints = ()
+        self.descriptors = None
+        self.frames = 0
+        self.detected_cells = 0
+
+    def _plan(self, shape):
+        h, w = shape[:2]
+        xs = np.linspace(0, w, self.cols + 1).astype(int)
+        ys = np.linspace(0, h, self.rows + 1).astype(int)
+        self.cells = [(xs[c], ys[r], xs[c + 1], ys[r + 1]) for r in range(self.rows) for c in range(self.cols)]
+        self.shape = shape
+
+    def _small(self, gray):
+        '''The frame at block x block pixels per cell (cells may differ by one pixel in size).'''
+        return cv2.resize(gray, (self.cols * self.block, self.rows * self.block),
+                          dst=self._buffer("small", (self.rows * self.block, self.cols * self.block)),
+                          interpolation=cv2.INTER_AREA)
+
+    def changed_cells(self, gray):
+        '''Indices of the cells that have to be detected again.'''
+        n = self.cols * self.rows
+        if self.change_threshold is None or self.reference is None or self.shape != gray.shape:
+            return list(range(n))
+        diff = cv2.absdiff(self._small(gray), self.reference, dst=self._buffer("diff", self.reference.shape))
+        # Largest difference per cell: (rows, block, cols, block) -> (rows, cols)
+        peak = diff.reshape(self.rows, self.block, self.cols, self.block).max(axis=(1, 3)).ravel()
+        return list(np.flatnonzero((peak > self.change_threshold) | (self.age >= self.max_age)))
+
+    def _detect_cell(self, i, gray):
+        x0, y0, x1, y1 = self.cells[i]
+        h, w = gray.shape
+        ax0, ay0 = max(0, x0 - self.halo), max(0, y0 - self.halo)
+        ax1, ay1 = min(w, x1 + self.halo), min(h, y1 + self.halo)
+        keypoints, descriptors = self.orbs[i].detectAndCompute(gray[ay0:ay1, ax0:ax1], None)
+
+        # Keep the keypoints inside the cell itself, moved to frame coordinates
+        kept, rows = [], []
+        for j, kp in enumerate(keypoints):
+            x, y = kp.pt[0] + ax0, kp.pt[1] + ay0
+            if x0 <= x < x1 and y0 <= y < y1:
+                kept.append(cv2.KeyPoint(x, y, kp.size, kp.angle, kp.response, kp.octave, kp.class_id))
+                rows.append(j)
+        self.cell_keypoints[i] = tuple(kept)
+        self.cell_descriptors[i] = descriptors[rows] if rows else None
+
+    def detect_and_compute(self, gray):
+        '''Keypoints (tuple of cv2.KeyPoint) and descriptors ((N, 32) uint8 or None) of a grayscale frame.'''
+        if self.shape != gray.shape:
+            self.reset()
+            self._plan(gray.shape)
+        changed = self.changed_cells(gray)
+        self.frames += 1
+        self.age += 1
+
+        if changed:
+            if self.pool is None or len(changed) == 1:
+                for i in changed:
+                    self._detect_cell(i, gray)
+            else:
+                # list() waits for all cells and re-raises any exception from a worker
+                list(self.pool.map(self._detect_cell, changed, [gray] * len(changed)))
+            self.detected_cells += len(changed)
+            self.age[changed] = 0
+
+            # The reference of the detected cells becomes this frame (the others keep theirs)
+            small = self._small(gray)
+            if self.reference is None or len(changed) == len(self.cells):
+                self.reference = small.copy()
+            else:
+                b = self.block
+                for i in changed:
+                    r, c = divmod(i, self.cols)
+                    self.reference[r * b:(r + 1) * b, c * b:(c + 1) * b] = small[r * b:(r + 1) * b, c * b:(c + 1) * b]
+
+            self.keypoints = tuple(kp for kps in self.cell_keypoints for kp in kps)
+            descriptors = [d for d in self.cell_descriptors if d is not None]
+            self.descriptors = np.vstack(descriptors) if descriptors else None
+        return self.keypoints, self.descriptors
+
+    def stats(self):
+        '''Share of the cells that were detected (the rest came from the cache).'''
+        total = self.frames * self.cols * self.rows
+        return {
+            "frames": self.frames,
+            "detected_cells": round(self.detected_cells / total, 4) if total else 0.0,
+            "keypoints": len(self.keypoints),
+        }
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def cell_counts(keypoints, shape, cols=4, rows=3):
+    '''Number of keypoints in every cell of a cols x rows grid (to judge how well they are spread).'''
+    h, w = shape[:2]
+    counts = np.zeros((rows, cols), dtype=np.int64)
+    for kp in keypoints:
+        x, y = kp.pt
+        counts[min(int(y * rows / h), rows - 1), min(int(x * cols / w), cols - 1)] += 1
+    return counts
+
+
+def main():
+    from vision.background import static_scene
+    from vision.bench import latency_stats, time_calls
+
+    parser = argparse.ArgumentParser(description="Compare grid ORB with full-frame ORB")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--nfeatures", type=int, default=500)
+    args = parser.parse_args()
+
+    frames = [cv2.cvtColor(f, cv2.COLOR_BGR2GRAY) for f in static_scene(args.width, args.height, args.frames)]
+    # A strongly textured patch in one corner, as in a real scene with one busy area
+    patch = np.random.default_rng(1).integers(0, 256, (args.height // 3, args.width // 4), dtype=np.uint8)
+    for f in frames:
+        f[:patch.shape[0], :patch.shape[1]] = patch
+
+    orb = cv2.ORB_create(nfeatures=args.nfeatures)
+    grid = GridOrb(args.nfeatures)
+    cached = GridOrb(args.nfeatures)
+    uncached = GridOrb(args.nfeatures, change_threshold=None)
+
+    def spread(keypoints):
+        counts = cell_counts(keypoints, frames[0].shape)
+        return {"keypoints": int(counts.sum()), "empty_cells": int(np.count_nonzero(counts == 0)),
+                "largest_cell_share": round(float(counts.max() / max(counts.sum(), 1)), 3)}
+
+    report = {
+        "full frame detect": latency_stats(time_calls(lambda f: orb.detect(f, None), frames, len(frames))),
+        "full frame detectAndCompute": latency_stats(time_calls(lambda f: orb.detectAndCompute(f, None),
+                                                                frames, len(frames))),
+        "grid, no cache": latency_stats(time_calls(uncached.detect_and_compute, frames, len(frames))),
+        "grid, cache": latency_stats(time_calls(cached.detect_and_compute, frames, len(frames), warmup=0)),
+        "cache": cached.stats(),
+        "spread full frame": spread(orb.detect(frames[0], None)),
+        "spread grid": spread(grid.detect_and_compute(frames[0])[0]),
+    }
+    for g in (grid, cached, uncached):
+        g.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
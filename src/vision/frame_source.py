@@ -0,0 +1,358 @@
+'''
+Threaded Frame Source
+Captures frames in a background thread so capture, processing and display overlap
+instead of running one after another in the same loop.
+
+Frames are written into a small ring of preallocated buffers (no new array per frame).
+The processing loop always gets the NEWEST frame. Frames that were captured but never
+read (because processing was slower than the camera) are counted as dropped.
+
+A "grabber" is the object that actually fills a buffer with pixels:
+    CameraGrabber     - Raspberry Pi camera (picamzero / Picamera2)
+    VideoFileGrabber  - video file or any other cv2.VideoCapture source
+    SyntheticGrabber  - generated moving test pattern (benchmarks without a camera)
+Every grabber takes a pixel_format (BGR888 or GRAY, see ingest.py) and delivers frames in it.
+
+Usage:
+    source = ThreadedFrameSource(SyntheticGrabber(640, 480))
+    source.start()
+    frame = source.read()
+    ...
+    source.stop()
+'''
+
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from vision.ingest import BGR888, Ingest, configure_camera, frame_shape, luma_view, synthetic_yuv420
+
+
+class CameraGrabber:
+    '''
+    Grabs frames from the Raspberry Pi camera through the picamzero Camera object.
+    The camera is asked for the stream format that matches pixel_format (see ingest.py),
+    and each frame is ingested straight from the camera buffer into our ring buffer.
+    '''
+
+    def __init__(self, pixel_format=BGR888, size=None):
+        # Imported here so the rest of the module works on machines without picamzero
+        from picamzero import Camera
+        from picamera2 import MappedArray
+
+        self.MappedArray = MappedArray
+        self.cam = Camera()
+        configure_camera(self.cam.pc2, pixel_format, size)
+
+        width, height = self.cam.pc2.camera_config["main"]["size"]
+        self.shape = frame_shape(pixel_format, height, width)
+        self.dtype = np.dtype(np.uint8)
+        self.ingest = Ingest(pixel_format)
+
+    def grab(self, dst):
+        # capture_request() gives us the camera's own buffer (capture_array() would copy it)
+        request = self.cam.pc2.capture_request()
+        try:
+            with self.MappedArray(request, "main") as mapped:
+                self.ingest.convert(mapped.array, dst)
+        finally:
+            # Give the buffer back to the camera as soon as possible
+            request.release()
+        return True
+
+    def close(self):
+        self.cam.stop_preview()
+
+
+class VideoFileGrabber:
+    '''Grabs frames from a video file (or anything cv2.VideoCapture can open).'''
+
+    def __init__(self, path, pixel_format=BGR888, loop=True):
+        self.path = path
+        self.loop = loop
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise IOError(f"Could not open video source: {path}")
+
+        ok, first = self.cap.read()
+        if not ok:
+            raise IOError(f"Could not read a frame from: {path}")
+        self.shape = frame_shape(pixel_format, *first.shape[:2])
+        self.dtype = first.dtype
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+        # Decoded frames are BGR: decode straight into dst, or into a reused buffer for GRAY
+        self.ingest = Ingest(pixel_format)
+        self.raw = None if pixel_format == BGR888 else first
+
+    def grab(self, dst):
+        # read() decodes into the array we pass when it already has the right size and type
+        target = dst if self.raw is None else self.raw
+        ok, _ = self.cap.read(target)
+        if not ok and self.loop:
+            # End of file: rewind and keep going
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, _ = self.cap.read(target)
+        if ok and self.raw is not None:
+            self.ingest.convert(self.raw, dst)
+        return ok
+
+    def close(self):
+        self.cap.release()
+
+
+class SyntheticGrabber:
+    '''
+    Generates a moving test pattern (gradient background with a moving square).
+    fps limits the generation speed like a real camera would (None = as fast as possible).
+
+    raw_format="YUV420" generates camera-like YUV420 buffers (with padded rows) instead of BGR,
+    so the grayscale (luma plane) capture mode can be tested without a camera.
+    '''
+
+    def __init__(self, width=640, height=480, fps=30, pixel_format=BGR888, raw_format="BGR"):
+        if raw_format not in ("BGR", "YUV420"):
+            raise ValueError(f"Unknown raw format {raw_format!r}")
+
+        self.shape = frame_shape(pixel_format, height, width)
+        self.dtype = np.dtype(np.uint8)
+        self.ingest = Ingest(pixel_format)
+        self.fps = fps
+        self.count = 0
+        self.next_time = time.perf_counter()
+
+        if raw_format == "YUV420":
+            # Camera rows are padded to a multiple of 64 bytes
+            self.yuv_background = synthetic_yuv420(width, height, stride=(width + 63) // 64 * 64)
+            self.yuv = np.empty_like(self.yuv_background)
+        else:
+            self.yuv = None
+
+        # Background pattern is computed once; every frame starts as a copy of it
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)
+        self.background = np.empty((height, width, 3), dtype=np.uint8)
+        self.background[:, :, 0] = x[None, :]
+        self.background[:, :, 1] = y[:, None]
+        self.background[:, :, 2] = 128
+        # BGR888 frames are drawn straight into dst, GRAY frames go through a reused BGR buffer
+        self.frame = None if pixel_format == BGR888 else np.empty_like(self.background)
+
+    def grab(self, dst):
+        if self.fps:
+            # Wait until it is time for the next frame
+            delay = self.next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_time = max(self.next_time + 1.0 / self.fps, time.perf_counter())
+
+        h, w = self.shape[:2]
+        size = max(h // 6, 1)
+        x = (self.count * 4) % max(w - size, 1)
+        y = (self.count * 2) % max(h - size, 1)
+        self.count += 1
+
+        if self.yuv is not None:
+            # Draw the square on the Y plane only, then ingest the YUV420 buffer like a camera frame
+            np.copyto(self.yuv, self.yuv_background)
+            cv2.rectangle(luma_view(self.yuv, h, w), (x, y), (x + size, y + size), 255, -1)
+            self.ingest.convert(self.yuv, dst)
+            return True
+
+        target = dst if self.frame is None else self.frame
+        np.copyto(target, self.background)
+        cv2.rectangle(target, (x, y), (x + size, y + size), (255, 255, 255), -1)
+        if self.frame is not None:
+            self.ingest.convert(self.frame, dst)
+        return True
+
+    def close(self):
+        pass
+
+
+class ThreadedFrameSource:
+    '''
+    Runs a grabber in a background thread, writing into a ring of preallocated buffers.
+
+    num_buffers must be at least 3: one buffer is held by the reader, one holds the
+    newest finished frame and one is being written by the capture thread.
+    '''
+
+    def __init__(self, grabber, num_buffers=3):
+        if num_buffers < 3:
+            raise ValueError("num_buffers must be at least 3")
+
+        self.grabber = grabber
+        self.buffers = [np.empty(grabber.shape, dtype=grabber.dtype) for _ in range(num_buffers)]
+
+        self.lock = threading.Lock()
+        self.new_frame = threading.Condition(self.lock)
+        self.thread = None
+        self.running = False
+
+        # Ring state (protected by self.lock)
+        self.latest = None   # index of the newest finished frame
+        self.reading = None  # index of the buffer the reader is currently using
+        self.latest_seq = 0  # sequence number of the newest finished frame
+        self.read_seq = 0    # sequence number of the frame returned by the last read()
+        self.finished = False
+        self.error = None    # exception that stopped the capture thread, raised again by read()
+
+        # Statistics
+        self.frames_captured = 0
+        self.frames_read = 0
+        self.frames_dropped = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.grabber.close()
+
+    def _capture_loop(self):
+        try:
+            while self.running:
+                # Pick a buffer that is neither the newest frame nor in use by the reader
+                with self.lock:
+                    index = next(i for i in range(len(self.buffers))
+                                 if i != self.latest and i != self.reading)
+
+                # Grab without holding the lock so the reader is never blocked by capture
+                ok = self.grabber.grab(self.buffers[index])
+                if not ok:
+                    break
+
+                with self.lock:
+                    # The previous newest frame was never read -> it is dropped
+                    if self.latest is not None and self.latest_seq > self.read_seq:
+                        self.frames_dropped += 1
+
+                    self.latest = index
+                    self.latest_seq += 1
+                    self.frames_captured += 1
+                    self.new_frame.notify_all()
+        except Exception as error:
+            # Camera unplugged, broken file, ...: read() raises it in the processing thread
+            self.error = error
+        finally:
+            # Whatever stopped the loop, waiting readers must wake up
+            with self.lock:
+                self.finished = True
+                self.new_frame.notify_all()
+            self.running = False
+
+    def read(self, timeout=None):
+        '''
+        Returns the newest frame that has not been returned before.
+        Only waits if the processing loop is faster than the camera.
+        Returns None if the source has ended (or on timeout). If the capture thread failed,
+        its exception is raised here once the frames before it have been read.
+
+        The returned array is a buffer of the ring: it stays valid until the next read().
+        '''
+        with self.lock:
+            if not self.new_frame.wait_for(lambda: self.latest_seq > self.read_seq or self.finished,
+                                           timeout):
+                return None
+            if self.latest_seq == self.read_seq:
+                if self.error is not None:
+                    raise self.error
+                return None
+
+            self.reading = self.latest
+            self.read_seq = self.latest_seq
+            self.frames_read += 1
+            return self.buffers[self.reading]
+
+    def latest_frame(self):
+        '''Returns the newest frame without ever waiting (None before the first frame).'''
+        with self.lock:
+            if self.latest is None:
+                return None
+            if self.latest_seq > self.read_seq:
+                self.frames_read += 1
+            self.reading = self.latest
+            self.read_seq = self.latest_seq
+            return self.buffers[self.reading]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "captured": self.frames_captured,
+                "read": self.frames_read,
+                "dropped": self.frames_dropped,
+            }
+
+
+def open_grabber(spec, pixel_format=BGR888, size=None):
+    '''
+    Creates a grabber from a short text description (used by the command line tools):
+        "camera"          Raspberry Pi camera
+        "synthetic"       moving test pattern at 30 frames per second
+        "synthetic:60"    moving test pattern at 60 frames per second (0 = as fast as possible)
+        "file:PATH"       video file
+    size is (width, height); None uses the grabber's default size.
+    '''
+    kind, _, arg = spec.partition(":")
+    if kind == "camera":
+        return CameraGrabber(pixel_format=pixel_format, size=size)
+    if kind == "synthetic":
+        width, height = size or (640, 480)
+        fps = float(arg) if arg else 30
+        return SyntheticGrabber(width, height, fps=fps or None, pixel_format=pixel_format)
+    if kind == "file":
+        return VideoFileGrabber(arg, pixel_format=pixel_format)
+    raise ValueError(f"Unknown frame source {spec!r}")
+
+
+def open_source(spec, pixel_format=BGR888, size=None):
+    '''
+    Creates a frame source (not started yet) from a text description.
+    Accepts everything open_grabber() does, plus recordings made with vision/recording.py:
+        "replay:PATH"     play as fast as possible (zero-copy frames)
+        "replay-rt:PATH"  play with the original timing
+    '''
+    kind, _, arg = spec.partition(":")
+    if kind in ("replay", "replay-rt"):
+        from vision.recording import ReplaySource
+        return ReplaySource(arg, pixel_format=pixel_format, realtime=kind == "replay-rt")
+    return ThreadedFrameSource(open_grabber(spec, pixel_format, size))
+
+
+def benchmark(source, seconds=5.0, work_ms=0.0):
+    '''
+    Reads from a started source for some seconds, optionally simulating work_ms of
+    processing per frame, and returns the statistics plus the processing frame rate.
+    '''
+    start = time.perf_counter()
+    processed = 0
+    while time.perf_counter() - start < seconds:
+        frame = source.read(timeout=1.0)
+        if frame is None:
+            break
+        if work_ms:
+            time.sleep(work_ms / 1000.0)
+        processed += 1
+
+    elapsed = time.perf_counter() - start
+    result = source.stats()
+    result["fps"] = processed / elapsed
+    return result
+
+
+if __name__ == "__main__":
+    # Quick check without a camera: python -m vision.frame_source (run from src/)
+    source = ThreadedFrameSource(SyntheticGrabber(1280, 720, fps=30)).start()
+    try:
+        print(benchmark(source, seconds=3.0, work_ms=50.0))
+    finally:
+        source.stop()
@@ -0,0 +1,166 @@
+'''
+Frame Ingest
+Turns whatever the camera delivers into the pixel format a script actually needs,
+writing into a buffer we already own (dst=) instead of allocating a new array every frame.
+
+Pixel formats a script can ask for:
+    BGR888 - 3 channel colour image in OpenCV (B, G, R) order
+    GRAY   - 1 channel luma (brightness) image
+
+Raw frames we know how to ingest:
+    (h, w, 4)        RGBA/XBGR frame (default picamzero output, 4 bytes per pixel)
+    (h, w, 3)        BGR frame (Picamera2 "RGB888" is stored B, G, R in memory)
+    (h * 3 // 2, w)  YUV420 (I420) planar frame: Y plane on top, then U and V
+    (h, w)           single channel frame
+
+Instead of converting RGBA -> BGR in the script, we ask the camera for the format we need:
+BGR888 scripts get "RGB888" frames (only a copy is left), GRAY scripts get "YUV420" frames
+(the Y plane IS the grayscale image, so there is nothing to convert at all).
+'''
+
+import cv2
+import numpy as np
+
+BGR888 = "BGR888"
+GRAY = "GRAY"
+
+PIXEL_FORMATS = (BGR888, GRAY)
+
+# Picamera2 stream format to request for each pixel format
+CAMERA_FORMATS = {
+    BGR888: "RGB888",
+    GRAY: "YUV420",
+}
+
+
+def check_pixel_format(pixel_format):
+    if pixel_format not in PIXEL_FORMATS:
+        raise ValueError(f"Unknown pixel format {pixel_format!r}, expected one of {PIXEL_FORMATS}")
+
+
+def frame_shape(pixel_format, height, width):
+    '''Shape of an ingested frame of the given size.'''
+    check_pixel_format(pixel_format)
+    if pixel_format == BGR888:
+        return (height, width, 3)
+    return (height, width)
+
+
+def is_yuv420(raw, height):
+    '''True if raw looks like a planar YUV420 frame for an image of the given height.'''
+    return raw.ndim == 2 and raw.shape[0] == height * 3 // 2
+
+
+def luma_view(yuv, height, width):
+    '''
+    Returns the Y (luma) plane of a YUV420 frame as a zero-copy NumPy view.
+    The Y plane is stored first, one byte per pixel, so it is simply the top `height` rows
+    (cut to `width` columns, because camera rows can be padded to a larger stride).
+    '''
+    return yuv[:height, :width]
+
+
+def synthetic_yuv420(width, height, stride=None):
+    '''
+    Creates a synthetic YUV420 (I420) frame: a diagonal luma gradient with neutral colour.
+    stride adds padding at the end of every row like real camera buffers (None = no padding).
+    Useful for testing the grayscale mode without a camera.
+    '''
+    stride = stride or width
+    if stride < width or stride % 2:
+        raise ValueError("stride must be an even number >= width")
+
+    yuv = np.full((height * 3 // 2, stride), 128, dtype=np.uint8)
+    x = np.arange(width, dtype=np.uint16)
+    y = np.arange(height, dtype=np.uint16)
+    luma_view(yuv, height, width)[:] = ((x[None, :] + y[:, None]) * 255 // (width + height)).astype(np.uint8)
+    return yuv
+
+
+def configure_camera(pc2, pixel_format, size=None):
+    '''
+    Reconfigures a Picamera2 instance (picamzero's cam.pc2) to deliver the stream format
+    that matches pixel_format. size is (width, height); None keeps the current size.
+    '''
+    check_pixel_format(pixel_format)
+    if size is None:
+        size = pc2.camera_config["main"]["size"]
+
+    pc2.stop()
+    config = pc2.create_preview_configuration(main={"format": CAMERA_FORMATS[pixel_format],
+                                                    "size": tuple(size)})
+    pc2.configure(config)
+    pc2.start()
+
+
+class Ingest:
+    '''Converts raw frames into pixel_format, writing into a caller-owned dst buffer.'''
+
+    def __init__(self, pixel_format=BGR888):
+        check_pixel_format(pixel_format)
+        self.pixel_format = pixel_format
+        self.packed = None   # contiguous I420 copy of padded YUV420 frames
+
+    def _pack_i420(self, raw, h, w):
+        '''
+        Repacks a YUV420 frame with padded rows into a contiguous I420 buffer. The U and V rows
+        are stride / 2 bytes wide (two of them per row of the 2D array), so cutting every row
+        of raw to w columns is only right for the Y plane.
+        '''
+        stride = raw.shape[1]
+        if self.packed is None or self.packed.shape != (h * 3 // 2, w):
+            self.packed = np.empty((h * 3 // 2, w), dtype=np.uint8)
+        src, dst = raw.reshape(-1), self.packed.reshape(-1)
+        np.copyto(dst[:h * w].reshape(h, w), src[:h * stride].reshape(h, stride)[:, :w])
+        ch, cw, cstride = h // 2, w // 2, stride // 2
+        for plane in range(2):   # U, then V
+            s0 = h * stride + plane * ch * cstride
+            d0 = h * w + plane * ch * cw
+            np.copyto(dst[d0:d0 + ch * cw].reshape(ch, cw), src[s0:s0 + ch * cstride].reshape(ch, cstride)[:, :cw])
+        return self.packed
+
+    def convert(self, raw, dst):
+        h, w = dst.shape[:2]
+
+        if is_yuv420(raw, h):
+            # YUV420 planar frame (may have padding at the end of each row)
+            if self.pixel_format == GRAY:
+                # The Y plane is the grayscale image: no conversion, one byte per pixel to copy
+                np.copyto(dst, luma_view(raw, h, w))
+            else:
+                packed = raw if raw.shape[1] == w else self._pack_i420(raw, h, w)
+                cv2.cvtColor(packed, cv2.COLOR_YUV2BGR_I420, dst=dst)
+
+        elif raw.ndim == 2:
+            # Single channel frame
+            if self.pixel_format == GRAY:
+                np.copyto(dst, raw[:h, :w])
+            else:
+                cv2.cvtColor(raw[:h, :w], cv2.COLOR_GRAY2BGR, dst=dst)
+
+        elif raw.shape[2] == 4:
+            # RGBA/XBGR frame (same conversion codes the lecture scripts used)
+            code = cv2.COLOR_RGBA2GRAY if self.pixel_format == GRAY else cv2.COLOR_RGBA2BGR
+            cv2.cvtColor(raw[:h, :w], code, dst=dst)
+
+        else:
+            # BGR frame
+            if self.pixel_format == GRAY:
+                cv2.cvtColor(raw[:h, :w], cv2.COLOR_BGR2GRAY, dst=dst)
+            else:
+                np.copyto(dst, raw[:h, :w])
+
+        return dst
+
+    def view(self, raw, height, width):
+        '''
+        Zero-copy version of convert(): returns a view into raw when no conversion is needed
+        (GRAY from YUV420, or raw already in the requested format), otherwise None.
+        The view is only valid as long as raw is (e.g. until a camera request is released).
+        '''
+        if self.pixel_format == GRAY:
+            if is_yuv420(raw, height) or raw.ndim == 2:
+                return luma_view(raw, height, width)
+        elif raw.ndim == 3 and raw.shape[2] == 3:
+            return raw[:height, :width]
+        return None
@@ -0,0 +1,179 @@
+'''
+Stage Instrumentation
+Measures how long every part of a loop takes (capture, convert, filter, hconcat, imshow, ...)
+so we can see which part eats the frame budget.
+
+Usage:
+    timer = StageTimer(csv_path="timings.csv")   # csv_path is optional: one row per frame
+    while True:
+        with timer.stage("capture"):
+            frame = source.read()
+        with timer.stage("filter"):
+            out = cv2.GaussianBlur(frame, (15, 15), 0)
+        timer.frame_done()
+        timer.draw_overlay(out)     # FPS and per-stage breakdown in the corner of the image
+
+    timer.write_prometheus("metrics.prom")      # Prometheus text format
+    timer.close()
+
+Every stage keeps a rolling window of its latest durations (for the live overlay and
+percentiles) and a cumulative histogram with fixed buckets (for the Prometheus export).
+'''
+
+import csv
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+# Histogram bucket upper bounds in seconds (Prometheus "le" buckets)
+BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.033, 0.05, 0.1, 0.2, 0.5, 1.0, float("inf"))
+
+
+class StageStats:
+    '''Timing statistics of one stage.'''
+
+    def __init__(self, window):
+        self.recent = deque(maxlen=window)    # latest durations in seconds
+        self.bucket_counts = np.zeros(len(BUCKETS), dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.recent.append(seconds)
+        self.bucket_counts[np.searchsorted(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def mean_ms(self):
+        return 1000.0 * sum(self.recent) / len(self.recent) if self.recent else 0.0
+
+    def percentile_ms(self, q):
+        return 1000.0 * float(np.percentile(self.recent, q)) if self.recent else 0.0
+
+
+class StageTimer:
+    '''High resolution timers for the stages of a processing loop.'''
+
+    def __init__(self, window=120, csv_path=None):
+        self.window = window
+        self.stages = {}                      # insertion order = order of the loop
+        self.frame_times = deque(maxlen=window)
+        self.frame_count = 0
+        self.last_frame = None
+        self.current = {}                     # durations of the frame in progress
+
+        # Optional CSV log with one row per frame (columns = stages seen in the first frame)
+        self.csv_columns = []
+        self.csv_file = None
+        self.csv_writer = None
+        if csv_path:
+            self.csv_file = open(csv_path, "w", newline="")
+            self.csv_writer = csv.writer(self.csv_file)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter_ns() - start) / 1e9)
+
+    def add(self, name, seconds):
+        '''Records a duration measured elsewhere (e.g. a stage's own timer).'''
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats(self.window)
+        stats.add(seconds)
+        self.current[name] = self.current.get(name, 0.0) + seconds
+
+    def frame_done(self):
+        '''Call once per loop iteration: updates the FPS and writes the CSV row.'''
+        now = time.perf_counter()
+        if self.last_frame is not None:
+            self.frame_times.append(now - self.last_frame)
+        self.last_frame = now
+        self.frame_count += 1
+
+        if self.csv_writer is not None:
+            if self.frame_count == 1:
+                self.csv_columns = list(self.stages)
+                self.csv_writer.writerow(["frame", "timestamp"] + [f"{n}_ms" for n in self.csv_columns])
+            self.csv_writer.writerow([self.frame_count, f"{time.time():.6f}"] +
+                                     [f"{1000.0 * self.current.get(n, 0.0):.3f}" for n in self.csv_columns])
+        self.current = {}
+
+    def fps(self):
+        if not self.frame_times:
+            return 0.0
+        return len(self.frame_times) / sum(self.frame_times)
+
+    def summary(self):
+        '''Per stage mean/p50/p95/p99 in milliseconds over the rolling window.'''
+        return {
+            name: {
+                "mean_ms": round(stats.mean_ms(), 3),
+                "p50_ms": round(stats.percentile_ms(50), 3),
+                "p95_ms": round(stats.percentile_ms(95), 3),
+                "p99_ms": round(stats.percentile_ms(99), 3),
+            }
+            for name, stats in self.stages.items()
+        }
+
+    def draw_overlay(self, image, origin=(10, 30), color=(0, 255, 0), title=None):
+        '''
+        Draws the FPS and the per-stage breakdown (mean over the rolling window) on image,
+        in place. Use it instead of a static cv2.putText label.
+        '''
+        x, y = origin
+        lines = []
+        if title:
+            lines.append(title)
+        lines.append(f"FPS: {self.fps():.1f}")
+        lines += [f"{name}: {stats.mean_ms():.1f} ms" for name, stats in self.stages.items()]
+
+        for line in lines:
+            cv2.putText(image, line, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 4)
+            cv2.putText(image, line, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 1)
+            y += 22
+        return image
+
+    def prometheus_text(self, prefix="vision"):
+        '''All stage histograms in the Prometheus text exposition format.'''
+        name = f"{prefix}_stage_duration_seconds"
+        out = [f"# HELP {name} Duration of a processing stage per frame.",
+               f"# TYPE {name} histogram"]
+        for stage, stats in self.stages.items():
+            cumulative = np.cumsum(stats.bucket_counts)
+            for bound, count in zip(BUCKETS, cumulative):
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {count}')
+            out.append(f'{name}_sum{{stage="{stage}"}} {stats.total:.9f}')
+            out.append(f'{name}_count{{stage="{stage}"}} {stats.count}')
+
+        out.append(f"# HELP {prefix}_fps Frames per second over the rolling window.")
+        out.append(f"# TYPE {prefix}_fps gauge")
+        out.append(f"{prefix}_fps {self.fps():.3f}")
+        out.append(f"# HELP {prefix}_frames_total Frames processed.")
+        out.append(f"# TYPE {prefix}_frames_total counter")
+        out.append(f"{prefix}_frames_total {self.frame_count}")
+        return "\n".join(out) + "\n"
+
+    def write_prometheus(self, path, prefix="vision"):
+        '''
+        Writes the metrics to a text file, e.g. for the node_exporter textfile collector.
+        The file is replaced in one step so a scraper never reads half a file.
+        '''
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus_text(prefix))
+        os.replace(tmp_path, path)
+
+    def close(self):
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = None
+            self.csv_writer = None
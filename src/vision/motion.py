@@ -0,0 +1,300 @@
+'''
+Motion-Gated Processing
+A fixed camera mostly sees a static scene, but every stage still processes every pixel of
+every frame. Here an expensive stage (Canny, bilateral, ORB, ...) only runs where the image
+changed, and the cached output is reused for the rest of the frame:
+
+    input -> motion detector -> dirty boxes -> stage on every box (+ halo) -> into the cache
+                                                                               |
+    output  <----------------------------------------------------------------- +
+
+Motion detector (works on a downscaled grayscale copy of the STAGE INPUT, so it also works
+for a stage in the middle of a pipeline):
+    "diff"        compares the input with a reference image: the input as it was when the
+                  cached output was computed. Slow changes (e.g. the light fading) add up
+                  until they are large enough, so the cache can never drift too far.
+    "background"  the foreground mask of the background model (background.py, as in
+                  07_background_subtraction.py) of this frame OR the previous one (so the
+                  place an object just left is recomputed too); shadows count as changes
+
+The changed pixels are grouped into boxes (connected regions). Every box is grown by the
+stage's "halo" twice: once because a changed pixel changes the output up to halo pixels away,
+and once more because the stage needs that much input around the output it recomputes. The
+halo comes from the stage itself (Stage.halo(): the kernel radius for its own ksize, d or
+sigma). When more than full_fraction of the frame changed, the stage runs on the whole frame.
+A stage without a known reach (a histogram or Otsu threshold of the whole frame) cannot be
+gated: GatedStage refuses it unless halo= is given.
+
+Measured at 1280x720 on the static test scene (x86, 1 core, python -m vision.motion): the
+bilateral filter drops from ~130-190 ms to ~11 ms per frame (6% of the pixels processed),
+a full-frame ORB from 9.2 to 6.3 ms and Canny (already cheap) from 2.5 to 1.9 ms. The default
+orb stage caches unchanged grid cells itself (features.py) and gets slower when gated.
+
+The result matches the full frame result for filters with a fixed neighbourhood (bilateral,
+blur, mean, median), at any kernel size. Canny's hysteresis and ORB's feature budget (the
+best nfeatures in the whole frame) do not have a fixed reach, so near the boxes they can
+differ a little; compare() and the benchmark report by how much.
+
+Usage:
+    gated = GatedStage(create_stage("bilateral"))
+    out = gated.process(frame)          # same interface as any stage
+    print(gated.stats())
+
+    python -m vision.runner canny bilateral --gate canny,bilateral
+    python -m vision.motion --width 1280 --height 720
+'''
+
+import argparse
+import json
+
+import cv2
+import numpy as np
+
+from vision.background import BackgroundEngine
+from vision.stages import Stage
+
+METHODS = ("diff", "background")
+
+
+class MotionDetector:
+
+    def __init__(self, method="diff", threshold=15, scale=0.25, min_area=2, max_boxes=16):
+        '''
+        method     see METHODS
+        threshold  "diff": a pixel changed if it differs by more than this (gray levels)
+        scale      resolution of the motion mask relative to the frame
+        min_area   ignore changed regions smaller than this (pixels of the motion mask)
+        max_boxes  more regions than this are merged into one box
+        '''
+        if method not in METHODS:
+            raise ValueError(f"method must be one of {METHODS}")
+        self.method = method
+        self.threshold = threshold
+        self.scale = scale
+        self.min_area = min_area
+        self.max_boxes = max_boxes
+        self.engine = BackgroundEngine(scale=scale, gray=True, refine=False) if method == "background" else None
+        self.reference = None
+        self.buffers = {}
+
+    def _buffer(self, key, shape, dtype=np.uint8):
+        buf = self.buffers.get(key)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self.buffers[key] = buf
+        return buf
+
+    def reset(self):
+        self.reference = None
+
+    def _small(self, frame):
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._buffer("gray", frame.shape[:2]))
+        h, w = frame.shape
+        size = (max(int(round(w * self.scale)), 1), max(int(round(h * self.scale)), 1))
+        return cv2.resize(frame, size, dst=self._buffer("small", (size[1], size[0])), interpolation=cv2.INTER_AREA)
+
+    def changed_mask(self, frame):
+        '''Motion mask (255 = changed) at the detector resolution, None on the first frame.'''
+        if self.method == "background":
+            self.engine.apply(frame)
+            foreground = cv2.compare(self.engine.buffers["small_mask"], 0, cv2.CMP_GT,
+                                     dst=self._buffer("foreground", self.engine.buffers["small_mask"].shape))
+            first = self.reference is None
+            if first:
+                self.reference = foreground.copy()
+            mask = cv2.bitwise_or(foreground, self.reference, dst=self._buffer("mask", foreground.shape))
+            np.copyto(self.reference, foreground)
+            return None if first else mask
+
+        small = self._small(frame)
+        if self.reference is None or self.reference.shape != small.shape:
+            self.reference = small.copy()
+            return None
+        diff = cv2.absdiff(small, self.reference, dst=self._buffer("diff", small.shape))
+        return cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY, dst=self._buffer("mask", small.shape))[1]
+
+    def mark_processed(self, frame, mask):
+        '''"diff": the changed pixels were processed, so they become the new reference.'''
+        if self.method == "diff" and mask is not None:
+            np.copyto(self.reference, self.buffers["small"], where=mask > 0)
+
+    def boxes(self, mask, frame_shape):
+        '''Bounding boxes (x0, y0, x1, y1) of the changed regions, in frame pixels.'''
+        n, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        stats = stats[1:][stats[1:, cv2.CC_STAT_AREA] >= self.min_area]
+        if len(stats) == 0:
+            return []
+        h, w = frame_shape[:2]
+        sh, sw = mask.shape
+        # One motion mask pixel covers 1/scale frame pixels: round the box outwards
+        x0 = stats[:, 0] * w // sw
+        y0 = stats[:, 1] * h // sh
+        x1 = np.minimum(-(-(stats[:, 0] + stats[:, 2]) * w // sw), w)
+        y1 = np.minimum(-(-(stats[:, 1] + stats[:, 3]) * h // sh), h)
+        boxes = np.stack([x0, y0, x1, y1], axis=1)
+        if len(boxes) > self.max_boxes:
+            return [(int(x0.min()), int(y0.min()), int(x1.max()), int(y1.max()))]
+        return [tuple(int(v) for v in box) for box in boxes]
+
+
+def grow(box, by, shape):
+    x0, y0, x1, y1 = box
+    h, w = shape[:2]
+    return (max(x0 - by, 0), max(y0 - by, 0), min(x1 + by, w), min(y1 + by, h))
+
+
+def merge_boxes(boxes):
+    '''Merges overlapping boxes until none overlap (so no pixel is processed twice).'''
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+
+class GatedStage(Stage):
+    '''Runs the wrapped stage only on the changed regions of its input and caches the rest.'''
+
+    def __init__(self, stage, method="diff", threshold=15, scale=0.25, halo=None, full_fraction=0.4):
+        super().__init__()
+        self.stage = stage
+        self.name = stage.name
+        self.needs_gray = stage.needs_gray
+        self.halo = stage.halo() if halo is None else halo
+        if self.halo is None:
+            raise ValueError(f"Stage {self.name!r} does not state its reach (halo) and cannot be gated")
+        self.full_fraction = full_fraction
+        self.detector = MotionDetector(method, threshold, scale)
+        self.cache = None
+        self.keypoints = None
+        self.frames = 0
+        self.full_frames = 0
+        self.processed_pixels = 0
+        self.total_pixels = 0
+
+    def _full(self, frame):
+        out = self.stage.process(frame)
+        self.cache = self.buffer("cache", out.shape, out.dtype)
+        np.copyto(self.cache, out)
+        if hasattr(self.stage, "keypoints"):
+            self.keypoints = list(self.stage.keypoints)
+        self.full_frames += 1
+        self.processed_pixels += frame.shape[0] * frame.shape[1]
+
+    def _region(self, frame, inner):
+        x0, y0, x1, y1 = inner
+        cx0, cy0, cx1, cy1 = grow(inner, self.halo, frame.shape)
+        out = self.stage.process(frame[cy0:cy1, cx0:cx1])
+        if out.shape[:2] != (cy1 - cy0, cx1 - cx0):
+            raise ValueError(f"Stage {self.name!r} changes the image size and cannot be gated")
+        self.cache[y0:y1, x0:x1] = out[y0 - cy0:y1 - cy0, x0 - cx0:x1 - cx0]
+        self.processed_pixels += (cy1 - cy0) * (cx1 - cx0)
+
+        if self.keypoints is not None:
+            # Keypoints of the region replace the cached ones inside it (moved to frame coordinates)
+            def inside(x, y):
+                return x0 <= x < x1 and y0 <= y < y1
+            self.keypoints = [kp for kp in self.keypoints if not inside(*kp.pt)]
+            for kp in self.stage.keypoints:
+                x, y = kp.pt[0] + cx0, kp.pt[1] + cy0
+                if inside(x, y):
+                    self.keypoints.append(cv2.KeyPoint(x, y, kp.size, kp.angle, kp.response, kp.octave, kp.class_id))
+
+    def process(self, frame):
+        self.frames += 1
+        self.total_pixels += frame.shape[0] * frame.shape[1]
+        mask = self.detector.changed_mask(frame)
+        if mask is None or self.cache is None or self.cache.shape[:2] != frame.shape[:2]:
+            self._full(frame)
+            self.detector.mark_processed(frame, mask)
+            return self.cache
+
+        # A changed pixel changes the output up to halo pixels away
+        boxes = merge_boxes(grow(box, self.halo, frame.shape) for box in self.detector.boxes(mask, frame.shape))
+        area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in boxes)
+        if area > self.full_fraction * frame.shape[0] * frame.shape[1]:
+            self._full(frame)
+        else:
+            for box in boxes:
+                self._region(frame, box)
+        self.detector.mark_processed(frame, mask)
+
+        if self.keypoints is not None:
+            self.stage.keypoints = self.keypoints       # so the stage label counts all keypoints
+        return self.cache
+
+    def label(self):
+        return f"{self.stage.label()} [gated {self.stats()['processed']:.0%}]"
+
+    def stats(self):
+        '''Share of the pixels the stage really processed and how often it ran on the full frame.'''
+        return {
+            "frames": self.frames,
+            "full_frames": self.full_frames,
+            "processed": self.processed_pixels / self.total_pixels if self.total_pixels else 0.0,
+        }
+
+
+def compare(stage_factory, frames, **gate_params):
+    '''
+    Runs a stage on every frame with and without gating. Returns the time of both, the share
+    of pixels processed and how far the output is from the full frame result: the mean
+    absolute difference and the share of pixels that differ by more than the motion
+    threshold (small differences are expected: the cache keeps the sensor noise of the frame
+    it was computed from).
+    '''
+    from vision.bench import latency_stats, time_calls
+
+    threshold = gate_params.get("threshold", 15)
+    full, gated = stage_factory(), GatedStage(stage_factory(), **gate_params)
+    errors, wrong = [], []
+    for frame in frames:
+        diff = cv2.absdiff(full.process(frame), gated.process(frame))
+        if diff.ndim == 3:
+            diff = diff.max(axis=2)
+        errors.append(float(diff.mean()))
+        wrong.append(np.count_nonzero(diff > threshold) / diff.size)
+
+    return {
+        "full": latency_stats(time_calls(stage_factory().process, frames, len(frames), warmup=1)),
+        "gated": latency_stats(time_calls(GatedStage(stage_factory(), **gate_params).process, frames,
+                                          len(frames), warmup=0)),
+        "processed": round(gated.stats()["processed"], 4),
+        "full_frames": gated.stats()["full_frames"],
+        "mean_abs_error": round(float(np.mean(errors)), 3),
+        "wrong_pixels": round(float(np.max(wrong)), 5),
+    }
+
+
+def main():
+    from vision.background import static_scene
+    from vision.stages import create_stage
+
+    parser = argparse.ArgumentParser(description="Compare motion-gated stages with full frame processing")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--stages", default="canny,bilateral,orb")
+    parser.add_argument("--method", default="diff", choices=METHODS)
+    args = parser.parse_args()
+
+    frames = static_scene(args.width, args.height, args.frames)
+    report = {}
+    for name in args.stages.split(","):
+        report[name] = compare(lambda: create_stage(name), frames, method=args.method)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
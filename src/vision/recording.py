@@ -0,0 +1,294 @@
+'''
+Record and Replay
+Stores captured frames in a raw, append-only file so a pipeline can be re-run on exactly
+the same frames later - for deterministic regression tests and benchmarks without a camera.
+
+File layout (all numbers little-endian):
+    file header   64 bytes   magic "VISNRAW1"
+    record        64 byte header + frame bytes (padded to a multiple of 64 bytes)
+    record        ...
+
+Record header: magic "FRM1", timestamp (float64 seconds), height, width, channels (uint32),
+dtype (NumPy dtype string such as "|u1") and the number of frame bytes.
+
+The recorder writes through a memory map that grows in large chunks. The frame bytes are
+written BEFORE the record header, so a recording cut off by a crash or power loss simply
+ends at the last complete frame.
+
+The reader memory-maps the file and hands out frames as read-only zero-copy NumPy views.
+
+Usage (from src/):
+    python -m vision.recording record clip.raw --source camera --frames 300
+    python -m vision.recording info clip.raw
+    python -m vision.runner canny --source replay:clip.raw --headless
+'''
+
+import argparse
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+from vision.ingest import BGR888, Ingest, frame_shape
+
+FILE_MAGIC = b"VISNRAW1"
+RECORD_MAGIC = b"FRM1"
+HEADER_SIZE = 64
+ALIGNMENT = 64
+
+# magic, timestamp, height, width, channels, dtype, frame bytes
+RECORD_HEADER = struct.Struct("<4sd3I8sQ")
+
+
+def _padded(nbytes):
+    return (nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _scan(buf, size):
+    '''
+    Reads the record headers of a recording.
+    Returns a list of (data offset, timestamp, shape, dtype) and the end of the last complete record.
+    '''
+    if size < HEADER_SIZE or bytes(buf[:len(FILE_MAGIC)]) != FILE_MAGIC:
+        raise IOError("Not a frame recording (bad file header)")
+
+    index = []
+    offset = HEADER_SIZE
+    while offset + HEADER_SIZE <= size:
+        magic, timestamp, h, w, c, dtype, nbytes = RECORD_HEADER.unpack_from(buf, offset)
+        data = offset + HEADER_SIZE
+        if magic != RECORD_MAGIC or data + nbytes > size:
+            break  # end of the recording (or an incomplete last record)
+        shape = (h, w) if c == 0 else (h, w, c)
+        index.append((data, timestamp, shape, np.dtype(dtype.rstrip(b"\0").decode())))
+        offset = data + _padded(nbytes)
+    return index, offset
+
+
+class FrameRecorder:
+    '''
+    Appends frames to a recording through a growing memory map.
+    Opening an existing recording continues after its last complete frame.
+    '''
+
+    def __init__(self, path, chunk_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.file = open(path, "a+b")
+        self.file.seek(0, os.SEEK_END)
+        existing = self.file.tell()
+
+        if existing == 0:
+            self.file.write(FILE_MAGIC.ljust(HEADER_SIZE, b"\0"))
+            self.file.flush()
+            self.size = HEADER_SIZE
+        else:
+            with mmap.mmap(self.file.fileno(), existing, access=mmap.ACCESS_READ) as buf:
+                _, self.size = _scan(buf, existing)
+
+        self.capacity = max(existing, self.size)
+        self.map = None
+        self.frames_written = 0
+        self._remap(self.capacity)
+
+    def _remap(self, capacity):
+        if self.map is not None:
+            self.map.close()
+        if capacity > os.fstat(self.file.fileno()).st_size:
+            self.file.truncate(capacity)
+        self.map = mmap.mmap(self.file.fileno(), capacity)
+        self.capacity = capacity
+
+    def write(self, frame, timestamp=None):
+        frame = np.asarray(frame)
+        if frame.ndim not in (2, 3):
+            raise ValueError("Frames must be 2D (gray) or 3D (color) arrays")
+
+        needed = self.size + HEADER_SIZE + _padded(frame.nbytes)
+        if needed > self.capacity:
+            # Grow in big chunks so remapping is rare
+            self._remap(max(needed, self.capacity + self.chunk_bytes))
+
+        # Frame bytes first ...
+        data = self.size + HEADER_SIZE
+        dst = np.frombuffer(self.map, dtype=frame.dtype, count=frame.size, offset=data)
+        np.copyto(dst.reshape(frame.shape), frame)
+
+        # ... then the header that makes the record visible to readers
+        h, w = frame.shape[:2]
+        c = frame.shape[2] if frame.ndim == 3 else 0
+        RECORD_HEADER.pack_into(self.map, self.size, RECORD_MAGIC,
+                                time.time() if timestamp is None else timestamp,
+                                h, w, c, frame.dtype.str.encode(), frame.nbytes)
+
+        self.size = data + _padded(frame.nbytes)
+        self.frames_written += 1
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+            # Drop the unused part of the last chunk
+            self.file.truncate(self.size)
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Recording:
+    '''A recording opened for reading. Frames are read-only zero-copy views into the file.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+        self.index, _ = _scan(self.map, size)
+        self.timestamps = np.array([entry[1] for entry in self.index], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.index)
+
+    def frame(self, i):
+        offset, _, shape, dtype = self.index[i]
+        return np.frombuffer(self.map, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+    def __getitem__(self, i):
+        return self.frame(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.frame(i)
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError:
+            pass  # frames (views) are still in use; the map is closed when they are freed
+        self.file.close()
+
+
+class ReplaySource:
+    '''
+    Plays a recording with the same interface as ThreadedFrameSource (start/read/stop/stats).
+    No thread and no ring buffer is needed: read() returns zero-copy views into the file
+    whenever the recorded format already matches pixel_format.
+
+    realtime=False plays as fast as the pipeline can go, realtime=True keeps the original timing.
+    '''
+
+    def __init__(self, path, pixel_format=BGR888, realtime=False, loop=False):
+        self.recording = Recording(path)
+        if len(self.recording) == 0:
+            raise IOError(f"Recording {path} contains no frames")
+
+        self.ingest = Ingest(pixel_format)
+        h, w = self.recording.index[0][2][:2]
+        self.shape = frame_shape(pixel_format, h, w)
+        self.convert_buffer = None
+        self.realtime = realtime
+        self.loop = loop
+        self.position = 0
+        self.frames_read = 0
+        self.start_time = None
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def stop(self):
+        self.recording.close()
+
+    def read(self, timeout=None):
+        if self.position >= len(self.recording):
+            if not self.loop:
+                return None
+            self.position = 0
+            self.start_time = time.perf_counter()
+
+        if self.realtime:
+            # Wait until the frame is due (relative to the first frame of the recording)
+            due = self.recording.timestamps[self.position] - self.recording.timestamps[0]
+            delay = due - (time.perf_counter() - self.start_time)
+            if delay > 0:
+                time.sleep(delay)
+
+        raw = self.recording.frame(self.position)
+        self.position += 1
+        self.frames_read += 1
+
+        h, w = self.shape[:2]
+        frame = self.ingest.view(raw, h, w)
+        if frame is None:
+            # The recording has another pixel format: convert into our own reused buffer
+            if self.convert_buffer is None:
+                self.convert_buffer = np.empty(self.shape, np.uint8)
+            frame = self.ingest.convert(raw, self.convert_buffer)
+        return frame
+
+    def latest_frame(self):
+        return self.read()
+
+    def stats(self):
+        return {"captured": self.frames_read, "read": self.frames_read, "dropped": 0}
+
+
+def record(source, path, frames):
+    '''Records the given number of frames from a started frame source.'''
+    with FrameRecorder(path) as recorder:
+        while recorder.frames_written < frames:
+            frame = source.read(timeout=2.0)
+            if frame is None:
+                break
+            recorder.write(frame)
+        return recorder.frames_written
+
+
+def main():
+    from vision.frame_source import ThreadedFrameSource, open_grabber
+    from vision.ingest import PIXEL_FORMATS
+
+    parser = argparse.ArgumentParser(description="Record frames to / inspect a raw recording")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="record frames from a source")
+    rec.add_argument("path")
+    rec.add_argument("--source", default="camera", help="camera, synthetic[:fps] or file:PATH")
+    rec.add_argument("--size", default=None, help="frame size as WIDTHxHEIGHT")
+    rec.add_argument("--format", default=BGR888, choices=PIXEL_FORMATS)
+    rec.add_argument("--frames", type=int, default=300)
+
+    info = sub.add_parser("info", help="show what a recording contains")
+    info.add_argument("path")
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        size = tuple(int(v) for v in args.size.split("x")) if args.size else None
+        source = ThreadedFrameSource(open_grabber(args.source, args.format, size)).start()
+        try:
+            count = record(source, args.path, args.frames)
+        finally:
+            source.stop()
+        print(f"Recorded {count} frames to {args.path}")
+    else:
+        recording = Recording(args.path)
+        n = len(recording)
+        print(f"{args.path}: {n} frames")
+        if n:
+            _, _, shape, dtype = recording.index[0]
+            duration = recording.timestamps[-1] - recording.timestamps[0]
+            print(f"  shape {shape}, dtype {dtype}, duration {duration:.2f} s"
+                  + (f", {(n - 1) / duration:.1f} FPS" if duration > 0 else ""))
+        recording.close()
+
+
+if __name__ == "__main__":
+    main()
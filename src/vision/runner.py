@@ -0,0 +1,222 @@
+'''
+Pipeline Runner
+Runs a chain of lecture stages (see stages.py) on one capture in a single process,
+instead of starting a separate script for every operation.
+
+Usage (from src/):
+    python -m vision.runner grayscale median threshold erode
+    python -m vision.runner median:ksize=9 canny:threshold1=50,threshold2=150
+    python -m vision.runner blur bilateral --source synthetic --headless --frames 300
+    python -m vision.runner --list
+
+Stage parameters are given as name:key=value,key=value (values are Python literals).
+--headless skips the window (cv2.imshow) and prints the frame rate instead.
+--timings draws the FPS and a per-stage time breakdown over the image (see instrument.py),
+--metrics PATH / --csv PATH export the timings for offline analysis.
+--record PATH saves the input frames; replay them later with --source replay:PATH.
+--gate canny,bilateral runs those stages only where the image changed (see motion.py).
+'''
+
+import argparse
+import ast
+import time
+
+import cv2
+import numpy as np
+
+from vision.frame_source import open_source
+from vision.ingest import BGR888, GRAY
+from vision.instrument import StageTimer
+from vision.motion import METHODS as GATE_METHODS, GatedStage
+from vision.recording import FrameRecorder
+from vision.stages import STAGES, create_stage
+
+
+def parse_stage_spec(spec):
+    '''"median:ksize=7" -> ("median", {"ksize": 7})'''
+    name, _, args = spec.partition(":")
+    params = {}
+    for item in filter(None, args.split(",")):
+        key, _, value = item.partition("=")
+        try:
+            params[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            params[key] = value  # plain text value
+    return name, params
+
+
+class Pipeline:
+    '''A chain of stages. Each stage gets the output of the previous one.'''
+
+    def __init__(self, stages):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+
+    @classmethod
+    def from_specs(cls, specs):
+        return cls([create_stage(name, **params) for name, params in map(parse_stage_spec, specs)])
+
+    def pixel_format(self):
+        '''Grayscale capture is enough if the first stage only looks at grayscale anyway.'''
+        first = self.stages[0]
+        return GRAY if first.name == "grayscale" or first.needs_gray else BGR888
+
+    def process(self, frame, timer=None):
+        for stage in self.stages:
+            if timer is None:
+                frame = stage.process(frame)
+            else:
+                with timer.stage(stage.name):
+                    frame = stage.process(frame)
+        return frame
+
+    def gate(self, names, method="diff"):
+        '''Wraps the named stages so they only process the changed regions of their input.'''
+        self.stages = [GatedStage(stage, method=method) if stage.name in names else stage
+                       for stage in self.stages]
+
+    def describe(self):
+        return " -> ".join(stage.name for stage in self.stages)
+
+
+class SideBySide:
+    '''Builds the "input | output" display image in reused buffers.'''
+
+    def __init__(self):
+        self.buffers = {}
+
+    def _bgr(self, key, image):
+        if image.ndim == 3:
+            return image
+        buf = self.buffers.get(key)
+        if buf is None or buf.shape[:2] != image.shape:
+            buf = np.empty(image.shape + (3,), np.uint8)
+            self.buffers[key] = buf
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR, dst=buf)
+
+    def combine(self, left, right):
+        left = self._bgr("left", left)
+        right = self._bgr("right", right)
+        if right.shape != left.shape:
+            right = cv2.resize(right, (left.shape[1], left.shape[0]))
+        combined = self.buffers.get("combined")
+        if combined is None or combined.shape != (left.shape[0], left.shape[1] * 2, 3):
+            combined = np.empty((left.shape[0], left.shape[1] * 2, 3), np.uint8)
+            self.buffers["combined"] = combined
+        return cv2.hconcat([left, right], dst=combined)
+
+
+def run(pipeline, source, headless=False, max_frames=None, timer=None, overlay=False,
+        metrics_path=None, metrics_every=30, recorder=None):
+    '''
+    Processes frames until 'q' is pressed, the source ends or max_frames is reached.
+    With a StageTimer every part of the loop is timed; overlay=True draws the timings
+    on the image instead of the stage label.
+    '''
+    window = f"Left: Input | Right: {pipeline.describe()}"
+    display = SideBySide()
+    timer = timer or StageTimer()
+    frames = 0
+    start = time.perf_counter()
+
+    try:
+        while max_frames is None or frames < max_frames:
+            with timer.stage("capture"):
+                frame = source.read(timeout=2.0)
+            if frame is None:
+                break
+            if recorder is not None:
+                with timer.stage("record"):
+                    recorder.write(frame)
+
+            output = pipeline.process(frame, timer)
+            frames += 1
+
+            if not headless:
+                with timer.stage("hconcat"):
+                    combined = display.combine(frame, output)
+                with timer.stage("overlay"):
+                    if overlay:
+                        timer.draw_overlay(combined, title=pipeline.stages[-1].label())
+                    else:
+                        cv2.putText(combined, pipeline.stages[-1].label(), (10, 30),
+                                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                with timer.stage("imshow"):
+                    cv2.imshow(window, combined)
+                    key = cv2.waitKey(1) & 0xFF
+                if key == ord('q'):
+                    break
+
+            timer.frame_done()
+            if metrics_path and frames % metrics_every == 0:
+                timer.write_prometheus(metrics_path)
+
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if not headless:
+            cv2.destroyAllWindows()
+        if metrics_path:
+            timer.write_prometheus(metrics_path)
+
+    elapsed = time.perf_counter() - start
+    result = source.stats()
+    result["frames"] = frames
+    result["fps"] = frames / elapsed if elapsed > 0 else 0.0
+    result["stages"] = timer.summary()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a chain of lecture stages on one capture")
+    parser.add_argument("stages", nargs="*", help="stage names, optionally name:key=value,...")
+    parser.add_argument("--source", default="camera",
+                        help="camera, synthetic[:fps], file:PATH, replay:PATH or replay-rt:PATH")
+    parser.add_argument("--size", default=None, help="frame size as WIDTHxHEIGHT")
+    parser.add_argument("--headless", action="store_true", help="do not open a window")
+    parser.add_argument("--frames", type=int, default=None, help="stop after this many frames")
+    parser.add_argument("--timings", action="store_true",
+                        help="draw FPS and per-stage timings instead of the stage label")
+    parser.add_argument("--metrics", default=None, help="write Prometheus text metrics to this file")
+    parser.add_argument("--csv", default=None, help="write per-frame stage timings to this CSV file")
+    parser.add_argument("--record", default=None, help="record the input frames to this file")
+    parser.add_argument("--gate", default=None,
+                        help="comma separated stages that only run where the image changed")
+    parser.add_argument("--gate-method", default="diff", choices=GATE_METHODS,
+                        help="how changes are detected for --gate")
+    parser.add_argument("--list", action="store_true", help="list the available stages")
+    args = parser.parse_args()
+
+    if args.list or not args.stages:
+        for name, cls in STAGES.items():
+            print(f"{name:15s} {cls.__doc__.strip().splitlines()[0]}")
+        return
+
+    pipeline = Pipeline.from_specs(args.stages)
+    if args.gate:
+        pipeline.gate(args.gate.split(","), args.gate_method)
+    size = tuple(int(v) for v in args.size.split("x")) if args.size else None
+    source = open_source(args.source, pipeline.pixel_format(), size)
+    recorder = FrameRecorder(args.record) if args.record else None
+
+    print(f"Running: {pipeline.describe()}. Press 'q' to exit.")
+    timer = StageTimer(csv_path=args.csv)
+    source.start()
+    try:
+        result = run(pipeline, source, headless=args.headless, max_frames=args.frames,
+                     timer=timer, overlay=args.timings, metrics_path=args.metrics, recorder=recorder)
+    finally:
+        source.stop()
+        timer.close()
+        if recorder is not None:
+            recorder.close()
+
+    print(f"Processed {result['frames']} frames at {result['fps']:.1f} FPS "
+          f"(captured {result['captured']}, dropped {result['dropped']})")
+    for name, stats in result["stages"].items():
+        print(f"  {name:15s} mean {stats['mean_ms']:8.3f} ms  p95 {stats['p95_ms']:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
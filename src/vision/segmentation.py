@@ -0,0 +1,166 @@
+'''
+Segmentation (Thresholding) Engine
+A fixed threshold such as 127 breaks as soon as the lighting changes. This engine finds the
+threshold automatically:
+
+    "fixed"              the given value (like cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY))
+    "otsu"               Otsu's method: the value that separates the histogram into two classes
+                         with the largest between-class variance (best for two clear peaks)
+    "triangle"           triangle method: the bin farthest from a line from the histogram peak to
+                         its far end (good for one big peak, e.g. a bright object on dark background)
+    "adaptive_mean"      a different threshold for every pixel: the mean of its block_size x block_size
+                         neighbourhood minus C (OpenCV computes the means with running sums, so the
+                         cost does not depend on block_size)
+    "adaptive_gaussian"  the same with a Gaussian weighted mean
+
+Otsu and triangle are computed from a SUBSAMPLED histogram (every step-th pixel in both
+directions, see histogram.py) and the result is reused for up to reuse_frames frames. A cheap
+scene check (the mean of a sparse grid of pixels) forces an update as soon as the brightness
+changes by more than change_threshold gray levels.
+
+The result is written into one reused mask buffer (0/255). segment_packed() gives a bit-packed
+mask that the morphology engine (morphology.py) works on directly.
+
+Usage:
+    segmenter = Segmenter(mode="otsu")
+    mask = segmenter.segment(gray)          # uint8 mask, reused buffer
+    print(segmenter.threshold)              # threshold used for this frame
+    packed = segmenter.segment_packed(gray, morph)  # PackedMask for BinaryMorphology morph
+'''
+
+import cv2
+import numpy as np
+
+from vision.histogram import HistogramEngine
+from vision.morphology import BinaryMorphology
+
+MODES = ("fixed", "otsu", "triangle", "adaptive_mean", "adaptive_gaussian")
+
+
+def otsu_threshold(hist):
+    '''
+    Otsu's threshold from a 256-bin histogram (same result as cv2.THRESH_OTSU on the same pixels).
+    A (N, 256) array of histograms gives N thresholds at once.
+    '''
+    hist = np.asarray(hist, dtype=np.float64)
+    p = hist / np.maximum(hist.sum(axis=-1, keepdims=True), 1.0)
+    levels = np.arange(256)
+    omega = np.cumsum(p, axis=-1)        # share of pixels in the dark class (levels 0..t)
+    mu = np.cumsum(p * levels, axis=-1)  # their summed intensity
+    mu_total = mu[..., -1:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mu_total * omega - mu) ** 2 / (omega * (1.0 - omega))
+    between[~np.isfinite(between)] = 0.0
+    best = np.argmax(between, axis=-1)
+    return int(best) if best.ndim == 0 else best
+
+
+def triangle_threshold(hist):
+    '''Triangle threshold from a 256-bin histogram (follows OpenCV's THRESH_TRIANGLE).'''
+    hist = np.asarray(hist, dtype=np.float64)
+    nonzero = np.flatnonzero(hist)
+    if len(nonzero) == 0:
+        return 0
+    left = max(nonzero[0] - 1, 0)
+    right = min(nonzero[-1] + 1, 255)
+    peak = int(np.argmax(hist))
+
+    # Work on the longer side of the peak (mirror the histogram if that is the right side)
+    flipped = peak - left < right - peak
+    if flipped:
+        hist = hist[::-1]
+        left = 255 - right
+        peak = 255 - peak
+
+    thresh = left
+    if peak > left:
+        # Distance (up to a constant factor) of every bin to the line from (left, 0) to (peak, max)
+        i = np.arange(left + 1, peak + 1)
+        dist = hist[peak] * i + (left - peak) * hist[i]
+        best = int(np.argmax(dist))
+        if dist[best] > 0:
+            thresh = int(i[best])
+    thresh -= 1
+    return 255 - thresh if flipped else thresh
+
+
+class Segmenter:
+
+    def __init__(self, mode="otsu", thresh=127, step=4, reuse_frames=10, change_threshold=8.0,
+                 block_size=31, C=5):
+        '''
+        mode              see MODES
+        thresh            threshold for "fixed" mode
+        step              histogram subsampling for "otsu" and "triangle"
+        reuse_frames      recompute the global threshold at least every this many frames
+        change_threshold  recompute sooner if the scene brightness changes by more than this
+        block_size, C     neighbourhood size (odd) and offset of the adaptive modes
+        '''
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        if block_size % 2 == 0 or block_size < 3:
+            raise ValueError("block_size must be odd and >= 3")
+
+        self.mode = mode
+        self.threshold = thresh
+        self.engine = HistogramEngine(step=step, channels="luma")
+        self.reuse_frames = reuse_frames
+        self.change_threshold = change_threshold
+        self.block_size = block_size
+        self.C = C
+        self.morph = BinaryMorphology()     # only used for packing
+
+        self.age = None                     # frames since the threshold was computed
+        self.reference_mean = None          # scene brightness when it was computed
+        self.updates = 0
+        self.mask = None
+
+    def _scene_mean(self, gray):
+        '''Mean of a sparse grid of pixels (about 1/1000 of the frame).'''
+        return float(gray[::32, ::32].mean())
+
+    def update_threshold(self, gray):
+        '''Recomputes the global threshold if it is too old or the scene changed. Returns it.'''
+        if self.mode not in ("otsu", "triangle"):
+            return self.threshold
+
+        mean = self._scene_mean(gray)
+        if (self.age is not None and self.age < self.reuse_frames
+                and abs(mean - self.reference_mean) <= self.change_threshold):
+            self.age += 1
+            return self.threshold
+
+        hist = self.engine.count(gray)[0]
+        self.threshold = otsu_threshold(hist) if self.mode == "otsu" else triangle_threshold(hist)
+        self.age = 1
+        self.reference_mean = mean
+        self.updates += 1
+        return self.threshold
+
+    def segment(self, gray, dst=None):
+        '''Binary mask (255 = foreground) of a grayscale frame, written into dst or a reused buffer.'''
+        if dst is None:
+            if self.mask is None or self.mask.shape != gray.shape:
+                self.mask = np.empty_like(gray)
+            dst = self.mask
+
+        if self.mode == "adaptive_mean":
+            return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY,
+                                         self.block_size, self.C, dst=dst)
+        if self.mode == "adaptive_gaussian":
+            return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                         self.block_size, self.C, dst=dst)
+
+        cv2.threshold(gray, self.update_threshold(gray), 255, cv2.THRESH_BINARY, dst=dst)
+        return dst
+
+    def segment_packed(self, gray, morph=None):
+        '''
+        The same mask bit-packed (PackedMask) for BinaryMorphology. Pass the engine that will
+        process the mask as morph: the mask is then packed straight into that engine's buffer.
+        The global modes never create the uint8 mask at all.
+        '''
+        morph = morph or self.morph
+        if self.mode.startswith("adaptive"):
+            return morph.pack(self.segment(gray))
+        return morph.threshold(gray, self.update_threshold(gray))
@@ -0,0 +1,561 @@
+'''
+Stage Registry
+Each lecture script wraps ONE operation in its own capture/display loop. Here every
+operation is a "stage" with the same interface, so stages can be chained in one process:
+
+    grayscale -> median -> threshold -> erode
+
+A stage keeps its output buffer between frames and passes it to OpenCV as dst=,
+so a running pipeline does not allocate new full-size images every frame.
+
+Stages are registered by name with @register_stage and created with create_stage():
+    stage = create_stage("median", ksize=7)
+    out = stage.process(frame)
+
+The returned array belongs to the stage: it is overwritten on the next process() call.
+'''
+
+import math
+
+import cv2
+import numpy as np
+
+from vision.background import BackgroundEngine
+from vision.blur import GaussianBlurEngine
+from vision.features import GridOrb
+from vision.forward_warp import ForwardWarper, rotation_matrix
+from vision.histogram import HistogramEngine
+from vision.homography import PlanarRegistration
+from vision.morphology import BinaryMorphology
+from vision.segmentation import Segmenter
+from vision.stretching import ContrastStretcher
+from vision.tiling import bilateral_filter
+from vision.tracking import TrackManager
+from vision.tone import ToneMapper
+from vision.warp_cache import WarpCache, load_calibration
+
+STAGES = {}
+
+
+def register_stage(name):
+    '''Class decorator that adds a stage to the registry under the given name.'''
+    def decorator(cls):
+        cls.name = name
+        STAGES[name] = cls
+        return cls
+    return decorator
+
+
+def create_stage(name, **params):
+    if name not in STAGES:
+        raise KeyError(f"Unknown stage {name!r}, available stages: {', '.join(STAGES)}")
+    return STAGES[name](**params)
+
+
+class Stage:
+    '''Base class for all stages.'''
+
+    name = None
+
+    # True if the stage only works on single channel images (input is converted if needed)
+    needs_gray = False
+
+    def __init__(self):
+        self.buffers = {}
+
+    def buffer(self, key, shape, dtype=np.uint8):
+        '''Returns a reused buffer, allocating it only when the shape or type changes.'''
+        buf = self.buffers.get(key)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self.buffers[key] = buf
+        return buf
+
+    def to_gray(self, frame):
+        if frame.ndim == 2:
+            return frame
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.buffer("gray", frame.shape[:2]))
+
+    def process(self, frame):
+        raise NotImplementedError
+
+    def halo(self):
+        '''
+        How far (in pixels) an input pixel can change the output: the kernel radius of a filter,
+        0 for per-pixel operations. None if the reach is unknown or unbounded (e.g. a histogram
+        of the whole frame); such a stage cannot be gated (motion.py).
+        '''
+        return None
+
+    def label(self):
+        '''Short text describing the stage and its parameters (used for overlays).'''
+        return self.name
+
+
+# --- Lecture 2 ---------------------------------------------------------------------------
+
+@register_stage("grayscale")
+class GrayscaleStage(Stage):
+    '''01_grayscale.py'''
+
+    def process(self, frame):
+        return self.to_gray(frame)
+
+    def halo(self):
+        return 0
+
+
+@register_stage("contrast")
+class ContrastStage(Stage):
+    '''02_contrast.py: New = Alpha * Old + Beta (with optional gamma), through a lookup table.'''
+
+    def __init__(self, alpha=2.0, beta=0, gamma=1.0):
+        super().__init__()
+        self.tone = ToneMapper(alpha=alpha, beta=beta, gamma=gamma)
+
+    def process(self, frame):
+        return self.tone.apply(frame, dst=self.buffer("out", frame.shape))
+
+    def halo(self):
+        return 0
+
+    def label(self):
+        return f"contrast (alpha={self.tone.alpha})"
+
+
+@register_stage("brightness")
+class BrightnessStage(ContrastStage):
+    '''03_brightness.py: same formula as contrast, with the brightness (beta) changed.'''
+
+    def __init__(self, alpha=1.0, beta=50, gamma=1.0):
+        super().__init__(alpha, beta, gamma)
+
+    def label(self):
+        return f"brightness (beta={self.tone.beta})"
+
+
+@register_stage("histogram")
+class HistogramStage(Stage):
+    '''04_histogram.py: plot of the B, G, R and luma histograms with the same size as the input.'''
+
+    def __init__(self, step=4, decay=0.8, channels="all"):
+        super().__init__()
+        self.engine = HistogramEngine(step=step, decay=decay, channels=channels)
+
+    def process(self, frame):
+        self.engine.update(frame)
+        return self.engine.render(frame.shape[:2])
+
+
+@register_stage("stretch")
+class StretchStage(Stage):
+    '''05_histogram_stretching.py: percentile stretching to the full 0-255 range through a LUT.'''
+
+    def __init__(self, low=1.0, high=99.0, step=4, smoothing=0.8, mode="gray"):
+        super().__init__()
+        self.stretcher = ContrastStretcher(low=low, high=high, step=step, smoothing=smoothing, mode=mode)
+        self.needs_gray = mode == "gray"
+
+    def process(self, frame):
+        frame = self.to_gray(frame) if self.needs_gray else frame
+        return self.stretcher.apply(frame, dst=self.buffer("out", frame.shape))
+
+    def label(self):
+        return f"stretch {self.stretcher.bounds}"
+
+
+@register_stage("threshold")
+class ThresholdStage(Stage):
+    '''06_thresholding.py (mode "otsu", "triangle", "adaptive_mean", ...: segmentation.py)'''
+
+    needs_gray = True
+
+    def __init__(self, thresh=127, mode="fixed", step=4, reuse_frames=10, block_size=31, C=5):
+        super().__init__()
+        self.segmenter = Segmenter(mode, thresh, step=step, reuse_frames=reuse_frames,
+                                   block_size=block_size, C=C)
+
+    def process(self, frame):
+        gray = self.to_gray(frame)
+        return self.segmenter.segment(gray, dst=self.buffer("out", gray.shape))
+
+    def halo(self):
+        # Otsu and triangle take their threshold from the histogram of the whole frame
+        if self.segmenter.mode.startswith("adaptive"):
+            return self.segmenter.block_size // 2
+        return 0 if self.segmenter.mode == "fixed" else None
+
+    def label(self):
+        if self.segmenter.mode.startswith("adaptive"):
+            return f"threshold ({self.segmenter.mode})"
+        return f"threshold ({self.segmenter.threshold})"
+
+
+@register_stage("segment")
+class SegmentStage(Stage):
+    '''06 + 13/14 in one stage: threshold and morphology on a bit-packed mask (segmentation.py).
+
+    The frame is thresholded straight into the packed mask, the morphology runs on the packed
+    words and only the result is unpacked. op: "open", "close", "erode", "dilate" or None.
+    '''
+
+    needs_gray = True
+
+    def __init__(self, mode="otsu", thresh=127, op="open", ksize=5, iterations=1, step=4, reuse_frames=10,
+                 block_size=31, C=5):
+        super().__init__()
+        if op not in (None, "open", "close", "erode", "dilate"):
+            raise ValueError("op must be 'open', 'close', 'erode', 'dilate' or None")
+        self.segmenter = Segmenter(mode, thresh, step=step, reuse_frames=reuse_frames,
+                                   block_size=block_size, C=C)
+        self.morph = BinaryMorphology(ksize, iterations)
+        self.op = op
+
+    def process(self, frame):
+        gray = self.to_gray(frame)
+        mask = self.segmenter.segment_packed(gray, self.morph)
+        if self.op is not None:
+            mask = getattr(self.morph, self.op)(mask)
+        return self.morph.unpack(mask, self.buffer("out", gray.shape))
+
+    def label(self):
+        return f"segment ({self.segmenter.mode} {self.segmenter.threshold}, {self.op})"
+
+
+@register_stage("background")
+class BackgroundStage(Stage):
+    '''07_background_subtraction.py: MOG2 foreground mask (0=background, 255=foreground, 127=shadow).
+
+    scale < 1 learns the model on a downscaled frame, model="average" / "median" swaps in a
+    cheaper model (see background.py).
+    '''
+
+    def __init__(self, history=500, varThreshold=16, detectShadows=True, model="mog2", scale=1.0, gray=False,
+                 update_every=1, learning_rate=-1.0, threshold=25, refine=True):
+        super().__init__()
+        self.engine = BackgroundEngine(model, scale, gray, update_every, learning_rate, history=history,
+                                       var_threshold=varThreshold, detect_shadows=detectShadows,
+                                       threshold=threshold, refine=refine)
+
+    def process(self, frame):
+        return self.engine.apply(frame, dst=self.buffer("out", frame.shape[:2]))
+
+    def label(self):
+        return f"background ({self.engine.model}, scale {self.engine.scale:g})"
+
+
+# --- Lecture 3 ---------------------------------------------------------------------------
+
+@register_stage("blur")
+class GaussianBlurStage(Stage):
+    '''08_image_blur.py (method: auto, opencv, separable, pyramid or recursive, see blur.py)'''
+
+    def __init__(self, ksize=15, sigma=0, method="auto"):
+        super().__init__()
+        self.ksize = ksize
+        self.sigma = sigma
+        self.engine = GaussianBlurEngine(ksize, sigma, method)
+
+    def process(self, frame):
+        return self.engine.apply(frame, dst=self.buffer("out", frame.shape))
+
+    def halo(self):
+        # The kernel radius, or 3 sigma for the methods without a kernel (pyramid, recursive)
+        if self.engine.method in ("opencv", "separable"):
+            return self.engine.ksize // 2
+        return int(math.ceil(3 * self.engine.sigma))
+
+    def label(self):
+        return f"gaussian blur ({self.engine.ksize}x{self.engine.ksize}, {self.engine.method})"
+
+
+@register_stage("bilateral")
+class BilateralStage(Stage):
+    '''09_remove_noise.py (bilateral filtering cannot work in place, so out is a separate buffer)'''
+
+    def __init__(self, d=9, sigmaColor=75, sigmaSpace=75, tiles=1):
+        super().__init__()
+        self.d = d
+        self.sigma_color = sigmaColor
+        self.sigma_space = sigmaSpace
+        # tiles > 1 filters overlapping strips on several cores (same result, see tiling.py)
+        self.tiled = bilateral_filter(d, sigmaColor, sigmaSpace, tiles=tiles) if tiles > 1 else None
+
+    def process(self, frame):
+        out = self.buffer("out", frame.shape)
+        if self.tiled is not None:
+            return self.tiled.process(frame, out)
+        return cv2.bilateralFilter(frame, self.d, self.sigma_color, self.sigma_space, dst=out)
+
+    def halo(self):
+        # For d <= 0 OpenCV computes the diameter from sigmaSpace
+        return self.d // 2 if self.d > 0 else int(round(self.sigma_space * 1.5))
+
+
+@register_stage("canny")
+class CannyStage(Stage):
+    '''10_edge_detection.py'''
+
+    needs_gray = True
+
+    def __init__(self, threshold1=100, threshold2=200):
+        super().__init__()
+        self.threshold1 = threshold1
+        self.threshold2 = threshold2
+
+    def process(self, frame):
+        gray = self.to_gray(frame)
+        out = self.buffer("out", gray.shape)
+        return cv2.Canny(gray, self.threshold1, self.threshold2, edges=out)
+
+    def halo(self):
+        # Sobel (3x3) + non-maximum suppression reach 2 pixels; the hysteresis can follow an edge
+        # further, so this is an approximation (motion.py reports the difference)
+        return 8
+
+    def label(self):
+        return f"canny ({self.threshold1}, {self.threshold2})"
+
+
+@register_stage("mean")
+class MeanFilterStage(Stage):
+    '''11_mean_filter.py'''
+
+    def __init__(self, ksize=5):
+        super().__init__()
+        self.ksize = ksize
+
+    def process(self, frame):
+        out = self.buffer("out", frame.shape)
+        return cv2.blur(frame, (self.ksize, self.ksize), dst=out)
+
+    def halo(self):
+        return self.ksize // 2
+
+    def label(self):
+        return f"mean filter ({self.ksize}x{self.ksize})"
+
+
+@register_stage("median")
+class MedianFilterStage(Stage):
+    '''12_median_filter.py'''
+
+    def __init__(self, ksize=5):
+        super().__init__()
+        self.ksize = ksize
+
+    def process(self, frame):
+        out = self.buffer("out", frame.shape)
+        return cv2.medianBlur(frame, self.ksize, dst=out)
+
+    def halo(self):
+        return self.ksize // 2
+
+    def label(self):
+        return f"median filter ({self.ksize})"
+
+
+@register_stage("dilate")
+class DilateStage(Stage):
+    '''13_dilation.py (expects a binary image, e.g. after "threshold"; packed=True: morphology.py)'''
+
+    def __init__(self, ksize=5, iterations=1, packed=False):
+        super().__init__()
+        self.kernel = np.ones((ksize, ksize), np.uint8)
+        self.iterations = iterations
+        self.morph = BinaryMorphology(ksize, iterations) if packed else None
+
+    def process(self, frame):
+        if self.morph is not None:
+            # The packed masks have one bit per pixel: colour input is converted to gray first
+            gray = self.to_gray(frame)
+            return self.morph.unpack(self.morph.dilate(self.morph.pack(gray)), self.buffer("out", gray.shape))
+        out = self.buffer("out", frame.shape)
+        return cv2.dilate(frame, self.kernel, dst=out, iterations=self.iterations)
+
+    def halo(self):
+        return self.kernel.shape[0] // 2 * self.iterations
+
+
+@register_stage("erode")
+class ErodeStage(DilateStage):
+    '''14_erosion.py (expects a binary image, e.g. after "threshold"; packed=True: morphology.py)'''
+
+    def process(self, frame):
+        if self.morph is not None:
+            gray = self.to_gray(frame)
+            return self.morph.unpack(self.morph.erode(self.morph.pack(gray)), self.buffer("out", gray.shape))
+        out = self.buffer("out", frame.shape)
+        return cv2.erode(frame, self.kernel, dst=out, iterations=self.iterations)
+
+
+@register_stage("orb")
+class OrbStage(Stage):
+    '''15_ORB.py: output is the input with the detected keypoints drawn on it.
+
+    Keypoints and descriptors are computed per grid cell (cols x rows, each with its share of
+    nfeatures) and reused for cells that did not change (features.py). cols=1, rows=1,
+    change_threshold=None is the plain full-frame ORB.
+    '''
+
+    needs_gray = True
+
+    def __init__(self, nfeatures=500, cols=4, rows=3, change_threshold=12, max_age=30, threads=None):
+        super().__init__()
+        self.orb = GridOrb(nfeatures, cols, rows, threads=threads, change_threshold=change_threshold,
+                           max_age=max_age)
+        self.keypoints = ()
+        self.descriptors = None
+
+    def process(self, frame):
+        gray = self.to_gray(frame)
+        self.keypoints, self.descriptors = self.orb.detect_and_compute(gray)
+
+        # Draw on a copy of the input (DRAW_OVER_OUTIMG reuses our buffer instead of a new image)
+        out = self.buffer("out", gray.shape + (3,))
+        if frame.ndim == 2:
+            cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR, dst=out)
+        else:
+            np.copyto(out, frame)
+        cv2.drawKeypoints(out, self.keypoints, out, color=(0, 255, 0),
+                          flags=cv2.DRAW_MATCHES_FLAGS_DRAW_OVER_OUTIMG)
+        return out
+
+    def halo(self):
+        # The patch at the two finest pyramid levels (scale factor 1.2). Keypoints of the coarser
+        # levels and the feature budget reach further, so this is an approximation like Canny's.
+        return int(math.ceil(self.orb.halo * 1.2 ** 2))
+
+    def label(self):
+        return f"ORB ({len(self.keypoints)} keypoints, {self.orb.cols}x{self.orb.rows} grid)"
+
+
+# --- Lecture 4 ---------------------------------------------------------------------------
+
+@register_stage("forward_warp")
+class ForwardWarpStage(Stage):
+    '''
+    16_forward_image_warping.py: rotates a little more every frame by forward mapping
+    (forward_warp.py; mode "splat" or "fill" closes the holes, width/height downscale first).
+    '''
+
+    def __init__(self, angle_step=1, width=None, height=None, mode="nearest"):
+        super().__init__()
+        self.angle_step = angle_step
+        self.size = (width, height) if width and height else None
+        self.angle = 0
+        self.warper = ForwardWarper(mode)
+
+    def process(self, frame):
+        self.angle = (self.angle + self.angle_step) % 360
+        out = self.buffer("out", frame.shape)
+        small = cv2.resize(frame, self.size) if self.size else frame
+        h, w = small.shape[:2]
+        # With angle_step=0 the transform repeats and the cached lookup table is used
+        M = rotation_matrix(w, h, self.angle)
+        if self.size is None:
+            return self.warper.apply(frame, M, dst=out)
+        return cv2.resize(self.warper.apply(small, M), (frame.shape[1], frame.shape[0]), dst=out,
+                          interpolation=cv2.INTER_NEAREST)
+
+
+@register_stage("backward_warp")
+class BackwardWarpStage(Stage):
+    '''17_backward_image_warping.py: rotation with cached remap tables (angle_step=0 keeps angle fixed).
+
+    calibration: .npz file with camera_matrix and dist_coeffs, the lens undistortion is then
+    composed with the rotation into one remap table (see warp_cache.py). With a calibration
+    angle_step defaults to 0: a fixed transform reuses one table, a turning one needs a new
+    table every frame.
+    '''
+
+    def __init__(self, angle=0, angle_step=None, scale=1.0, calibration=None):
+        super().__init__()
+        self.angle = angle
+        self.angle_step = (0 if calibration else 1) if angle_step is None else angle_step
+        self.scale = scale
+        self.camera_matrix, self.dist_coeffs = load_calibration(calibration) if calibration else (None, None)
+        self.cache = WarpCache()
+
+    def process(self, frame):
+        self.angle = (self.angle + self.angle_step) % 360
+        h, w = frame.shape[:2]
+        M = cv2.getRotationMatrix2D((w // 2, h // 2), self.angle, self.scale)
+        out = self.buffer("out", frame.shape)
+        return self.cache.warp(frame, M, self.camera_matrix, self.dist_coeffs, dst=out)
+
+
+@register_stage("register")
+class RegistrationStage(Stage):
+    '''15 + 17: warps every frame onto a reference view of a planar object (homography.py).
+
+    ORB matches against the reference image, PROSAC estimates the homography (or affine
+    transform) and the frame is backward-warped into the reference view. reference: image
+    file (None: the first frame). A frame without a good estimate keeps the last transform.
+    '''
+
+    def __init__(self, reference=None, model="homography", nfeatures=1000, threshold=3.0, ratio=0.8,
+                 min_inliers=12):
+        super().__init__()
+        image = None
+        if reference:
+            image = cv2.imread(reference)
+            if image is None:
+                raise ValueError(f"Cannot read the reference image {reference!r}")
+        self.registration = PlanarRegistration(image, model, nfeatures, threshold, ratio, min_inliers)
+
+    def process(self, frame):
+        self.registration.estimate(self.to_gray(frame))
+        # The output has the size of the reference (black until the object was found once)
+        width, height = self.registration.reference_size
+        out = self.buffer("out", (height, width) + frame.shape[2:])
+        if self.registration.warp(frame, dst=out) is None:
+            out[:] = 0
+        return out
+
+    def label(self):
+        info = self.registration.info
+        if not info:
+            return "register"
+        return (f"register ({info['inliers']}/{info['matches']} inliers = {info['inlier_ratio']:.0%}, "
+                f"{info['iterations']} samples)")
+
+
+@register_stage("optical_flow")
+class OpticalFlowStage(Stage):
+    '''18_optical_flow_and_tracking.py: Lucas-Kanade tracks drawn on the input.
+
+    Tracks are checked forward-backward and empty grid cells are re-seeded (tracking.py), so
+    the number of tracks stays near maxCorners. fb_threshold=None switches the check off.
+    '''
+
+    needs_gray = True
+
+    def __init__(self, maxCorners=100, qualityLevel=0.3, minDistance=7, blockSize=7,
+                 winSize=15, maxLevel=2, cols=5, rows=4, fb_threshold=1.0):
+        super().__init__()
+        self.tracker = TrackManager(maxCorners, cols, rows, fb_threshold=fb_threshold, winSize=winSize,
+                                    maxLevel=maxLevel, qualityLevel=qualityLevel, minDistance=minDistance,
+                                    blockSize=blockSize)
+
+    def reset(self):
+        self.tracker.reset()
+
+    def process(self, frame):
+        if frame.ndim == 2:
+            # The previous stage reuses its output buffer: the tracker keeps a copy
+            self.tracker.update(frame)
+        else:
+            # Two gray buffers take turns, so the tracker can keep the last one without a copy
+            key = "gray1" if self.tracker.previous is self.buffers.get("gray0") else "gray0"
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.buffer(key, frame.shape[:2]))
+            self.tracker.update(gray, copy=False)
+        out = self.buffer("out", frame.shape[:2] + (3,))
+        if frame.ndim == 2:
+            cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR, dst=out)
+        else:
+            np.copyto(out, frame)
+        return self.tracker.draw(out)
+
+    def label(self):
+        return f"optical flow ({self.tracker.count} tracks)"
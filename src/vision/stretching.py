@@ -0,0 +1,134 @@
+'''
+Contrast Stretching
+Robust, flicker-free histogram (contrast) stretching for live video:
+
+    - The stretch range is taken from the low/high PERCENTILES of the histogram (e.g. 1% and 99%)
+      instead of the absolute min and max, so a few hot or dead pixels cannot ruin it.
+    - The histogram is counted on a subsampled frame (see histogram.py), no full np.min/np.max passes.
+    - The bounds are smoothed over time (exponential moving average) so the image does not flicker.
+    - The stretch itself is a 256-entry lookup table applied with cv2.LUT. The table is only
+      rebuilt when the (rounded) bounds actually move.
+
+Modes for colour frames:
+    "gray"         stretch the grayscale image (colour frames are converted first)
+    "per_channel"  stretch B, G and R independently (also corrects a colour cast)
+    "hsv_v"        stretch only the V (brightness) channel in HSV, colours stay the same
+
+Usage:
+    stretcher = ContrastStretcher(low=1, high=99, mode="gray")
+    stretched = stretcher.apply(gray)
+    print(stretcher.bounds)      # [(low, high)] per stretched channel
+'''
+
+import cv2
+import numpy as np
+
+from vision.histogram import HistogramEngine
+
+MODES = ("gray", "per_channel", "hsv_v")
+
+
+def percentile_bounds(hist, low, high):
+    '''
+    Intensities at the low/high percentiles of normalized histograms (one per row).
+    Returns two arrays with one value per histogram.
+    '''
+    cdf = np.cumsum(hist, axis=1)
+    lo = np.array([np.searchsorted(row, low / 100.0) for row in cdf], dtype=np.float64)
+    hi = np.array([np.searchsorted(row, high / 100.0) for row in cdf], dtype=np.float64)
+    return lo, np.minimum(hi, 255.0)
+
+
+def stretch_lut(lo, hi):
+    '''256-entry table that maps lo -> 0 and hi -> 255 (clipped outside that range).'''
+    if hi <= lo:
+        return np.arange(256, dtype=np.uint8)  # flat image: leave it unchanged
+    values = (np.arange(256, dtype=np.float32) - lo) * (255.0 / (hi - lo))
+    return np.clip(values + 0.5, 0, 255).astype(np.uint8)
+
+
+class ContrastStretcher:
+
+    def __init__(self, low=1.0, high=99.0, step=4, smoothing=0.8, mode="gray"):
+        '''
+        low, high  percentiles (0-100) that are stretched to 0 and 255
+        step       histogram subsampling (count every step-th pixel in both directions)
+        smoothing  0 = follow every frame, towards 1 = bounds move slower (less flicker)
+        mode       "gray", "per_channel" or "hsv_v" (see the module docstring)
+        '''
+        if not 0.0 <= low < high <= 100.0:
+            raise ValueError("Need 0 <= low < high <= 100")
+        if not 0.0 <= smoothing < 1.0:
+            raise ValueError("smoothing must be in [0, 1)")
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+
+        self.low = low
+        self.high = high
+        self.smoothing = smoothing
+        self.mode = mode
+        # No smoothing in the engine: the BOUNDS are smoothed instead
+        self.engine = HistogramEngine(step=step)
+
+        self.smoothed = None         # float bounds, shape (2, channels)
+        self.bounds = []             # integer bounds the current LUT was built for
+        self.lut = None
+        self.lut_key = None
+        self.lut_rebuilds = 0
+        self.buffers = {}
+
+    def _buffer(self, key, shape, dtype=np.uint8):
+        buf = self.buffers.get(key)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self.buffers[key] = buf
+        return buf
+
+    def _histograms(self, frame):
+        '''Normalized histograms of the channels that are stretched.'''
+        hist = self.engine.update(frame)
+        if frame.ndim == 3:
+            return hist[:3]                      # B, G, R ("per_channel" mode)
+        return hist                              # gray frame, or the V plane in "hsv_v" mode
+
+    def _update_lut(self, hist, hsv=False):
+        lo, hi = percentile_bounds(hist, self.low, self.high)
+        current = np.stack([lo, hi])
+        if self.smoothed is None or self.smoothed.shape != current.shape:
+            self.smoothed = current
+        else:
+            self.smoothed *= self.smoothing
+            self.smoothed += (1.0 - self.smoothing) * current
+
+        bounds = [(int(round(l)), int(round(h))) for l, h in self.smoothed.T]
+        if (hsv, bounds) != self.lut_key:
+            # Only rebuild the table when a bound moved by at least one gray level
+            tables = [stretch_lut(l, h) for l, h in bounds]
+            if hsv:
+                # Identity tables for H and S, so the whole HSV image goes through one cv2.LUT call
+                identity = np.arange(256, dtype=np.uint8)
+                tables = [identity, identity] + tables
+            self.lut = tables[0] if len(tables) == 1 else np.dstack(tables)
+            self.bounds = bounds
+            self.lut_key = (hsv, bounds)
+            self.lut_rebuilds += 1
+
+    def apply(self, frame, dst=None):
+        '''Stretches the frame. Without dst the result goes into a reused buffer.'''
+        if dst is None:
+            dst = self._buffer("out", frame.shape)
+
+        if self.mode == "hsv_v" and frame.ndim == 3:
+            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=self._buffer("hsv", frame.shape))
+            value = cv2.extractChannel(hsv, 2, dst=self._buffer("value", frame.shape[:2]))
+            self._update_lut(self._histograms(value), hsv=True)
+            cv2.LUT(hsv, self.lut, dst=hsv)
+            return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=dst)
+
+        if self.mode == "gray" and frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._buffer("gray", frame.shape[:2]))
+            if dst.shape != frame.shape:
+                dst = self._buffer("out_gray", frame.shape)
+
+        self._update_lut(self._histograms(frame))
+        return cv2.LUT(frame, self.lut, dst=dst)
@@ -0,0 +1,181 @@
+'''
+Tiled (Multi-Core) Filtering
+Splits a frame into horizontal strips and filters the strips on several CPU cores at once.
+OpenCV releases Python's GIL while it works, so plain threads really run in parallel.
+
+A filter with a kernel of radius r needs r extra rows above and below every strip (the "halo"),
+otherwise the pixels at the strip borders would see a different neighbourhood than in the full
+frame. Every strip is filtered WITH its halo into its own scratch buffer and only the inner rows
+are copied into the (preallocated) output, so the result is identical to filtering the full frame.
+
+    frame    strip 0 + halo  ->  filter  ->  rows of strip 0  --\
+             strip 1 + halo  ->  filter  ->  rows of strip 1  ----> output
+             strip 2 + halo  ->  filter  ->  rows of strip 2  --/
+
+This is exact for filters that only look at a fixed neighbourhood (bilateral, median, Gaussian,
+box, morphology). Canny is NOT guaranteed to be exact: its hysteresis step follows weak edges
+along connected pixels with no distance limit, so an edge may be kept in the full frame only
+because it connects to a strong edge in another strip. verify() reports how many pixels differ.
+
+Note: OpenCV also parallelises some filters internally. Both fight for the same cores, so
+compare against the full-frame call (python -m vision.tiling) on the target machine.
+
+Usage:
+    tiled = bilateral_filter(d=9, sigmaColor=75, sigmaSpace=75)
+    out = tiled.process(frame)
+    print(verify(tiled, frame))
+
+    python -m vision.tiling --width 1920 --height 1080     (speed and exactness of every filter)
+'''
+
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+class TiledExecutor:
+    '''Runs fn(src, dst) on overlapping horizontal strips of a frame in a persistent thread pool.'''
+
+    def __init__(self, fn, halo, tiles=None, workers=None, name="filter"):
+        '''
+        fn       fn(src, dst) filters src into dst (same shape and type), e.g.
+                 lambda src, dst: cv2.medianBlur(src, 5, dst=dst)
+        halo     extra rows needed above and below each strip (the kernel radius)
+        tiles    number of strips (default: number of CPU cores)
+        workers  number of threads (default: tiles)
+        '''
+        self.fn = fn
+        self.halo = halo
+        self.tiles = tiles or os.cpu_count() or 1
+        self.name = name
+        self.pool = ThreadPoolExecutor(max_workers=workers or self.tiles, thread_name_prefix="tile")
+        self.layout = None          # (frame shape, list of strips)
+        self.scratch = []
+        self.out = None
+
+    def _plan(self, shape):
+        '''Splits the rows into strips: (output rows y0:y1, input rows a:b) per strip.'''
+        h = shape[0]
+        tiles = max(1, min(self.tiles, h))
+        bounds = np.linspace(0, h, tiles + 1).astype(int)
+        strips = []
+        for y0, y1 in zip(bounds[:-1], bounds[1:]):
+            a = max(0, y0 - self.halo)
+            b = min(h, y1 + self.halo)
+            strips.append((y0, y1, a, b))
+        self.layout = (shape, strips)
+        self.scratch = [np.empty((b - a,) + shape[1:], np.uint8) for _, _, a, b in strips]
+
+    def _run_strip(self, i, frame, out):
+        y0, y1, a, b = self.layout[1][i]
+        scratch = self.scratch[i]
+        self.fn(frame[a:b], scratch)
+        out[y0:y1] = scratch[y0 - a:y1 - a]
+
+    def process(self, frame, out=None):
+        '''Filters frame. Without out the result goes into a reused buffer.'''
+        if frame.dtype != np.uint8:
+            raise ValueError("Only uint8 frames are supported")
+        if self.layout is None or self.layout[0] != frame.shape:
+            self._plan(frame.shape)
+        if out is None:
+            if self.out is None or self.out.shape != frame.shape:
+                self.out = np.empty_like(frame)
+            out = self.out
+
+        if len(self.scratch) == 1:
+            self._run_strip(0, frame, out)   # nothing to split, skip the pool
+        else:
+            # list() waits for all strips and re-raises any exception from a worker
+            list(self.pool.map(self._run_strip, range(len(self.scratch)),
+                               [frame] * len(self.scratch), [out] * len(self.scratch)))
+        return out
+
+    def full_frame(self, frame):
+        '''The same filter on the whole frame in one call (the reference for verify()).'''
+        out = np.empty_like(frame)
+        self.fn(frame, out)
+        return out
+
+    def close(self):
+        self.pool.shutdown()
+
+
+# --- Ready-made tiled filters ------------------------------------------------------------
+# The halo of every filter is its kernel radius.
+
+def bilateral_filter(d=9, sigmaColor=75, sigmaSpace=75, **kwargs):
+    # For d <= 0 OpenCV computes the diameter from sigmaSpace
+    radius = d // 2 if d > 0 else int(round(sigmaSpace * 1.5))
+    return TiledExecutor(lambda src, dst: cv2.bilateralFilter(src, d, sigmaColor, sigmaSpace, dst=dst),
+                         radius, name="bilateral", **kwargs)
+
+
+def median_filter(ksize=5, **kwargs):
+    return TiledExecutor(lambda src, dst: cv2.medianBlur(src, ksize, dst=dst),
+                         ksize // 2, name="median", **kwargs)
+
+
+def gaussian_filter(ksize=15, sigma=0, **kwargs):
+    if ksize <= 0:
+        # Kernel size OpenCV derives from sigma for 8-bit images
+        ksize = int(round(sigma * 3 * 2 + 1)) | 1
+    return TiledExecutor(lambda src, dst: cv2.GaussianBlur(src, (ksize, ksize), sigma, dst=dst),
+                         ksize // 2, name="gaussian", **kwargs)
+
+
+def canny_filter(threshold1=100, threshold2=200, apertureSize=3, **kwargs):
+    '''Sobel radius + 1 row for the non-maximum suppression. Not exact, see the module docstring.'''
+    return TiledExecutor(lambda src, dst: cv2.Canny(src, threshold1, threshold2, edges=dst,
+                                                    apertureSize=apertureSize),
+                         apertureSize // 2 + 1, name="canny", **kwargs)
+
+
+def verify(executor, frame):
+    '''Compares the tiled result with the full-frame result.'''
+    tiled = executor.process(frame).copy()
+    full = executor.full_frame(frame)
+    diff = cv2.absdiff(tiled, full)
+    mismatched = int(np.count_nonzero(diff))
+    return {
+        "exact": mismatched == 0,
+        "mismatched_values": mismatched,
+        "max_abs_diff": int(diff.max()),
+    }
+
+
+def main():
+    from vision.bench import latency_stats, synthetic_frames, time_calls
+
+    parser = argparse.ArgumentParser(description="Compare tiled and full-frame filtering")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--tiles", type=int, default=None, help="number of strips (default: CPU cores)")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    frames = synthetic_frames(args.width, args.height, 5)
+    gray = [cv2.cvtColor(f, cv2.COLOR_BGR2GRAY) for f in frames]
+    executors = [(bilateral_filter(tiles=args.tiles), frames),
+                 (median_filter(tiles=args.tiles), frames),
+                 (gaussian_filter(tiles=args.tiles), frames),
+                 (canny_filter(tiles=args.tiles), gray)]
+
+    report = {"cpu_count": os.cpu_count(), "opencv_threads": cv2.getNumThreads(), "results": {}}
+    for executor, inputs in executors:
+        report["results"][executor.name] = {
+            "tiles": executor.tiles,
+            "full_frame": latency_stats(time_calls(executor.full_frame, inputs, args.repeat)),
+            "tiled": latency_stats(time_calls(executor.process, inputs, args.repeat)),
+            "verify": verify(executor, inputs[0]),
+        }
+        executor.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
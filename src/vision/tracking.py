@@ -0,0 +1,345 @@
+'''
+Track Manager for Lucas-Kanade Optical Flow
+In 18_optical_flow_and_tracking.py the set of tracked points only shrinks: every point that
+is lost is dropped, and the only way back is 'r', which throws all tracks away and runs
+cv2.goodFeaturesToTrack on the whole frame. Here every track has a life cycle:
+
+    born (detected in an empty grid cell) -> tracked every frame -> dropped when it fails
+
+*   Every track has a persistent ID, an age (frames tracked) and a short history of its
+    positions and tracking errors.
+*   Forward-backward check: every point is tracked forward (previous -> current frame) and
+    the result back again (current -> previous). A good track comes back to where it started;
+    if it lands more than fb_threshold pixels away, it drifted (occlusion, repeated texture,
+    a point on a moving edge) and is dropped. This catches errors that the LK status flag
+    does not report.
+*   Re-seeding: the frame is divided into a cols x rows grid. Only cells that are (nearly)
+    empty - fewer than min_per_cell tracks - are topped up, with cv2.goodFeaturesToTrack on THAT CELL only and a
+    mask that blocks the surroundings of the existing tracks (minDistance). The number of
+    tracks stays near max_tracks, and the cost of re-seeding depends on the number of empty
+    cells, not on the frame size.
+
+The state of all tracks is kept as a struct of arrays: one NumPy array per property (ids,
+points, ages, histories, ...), with the live tracks in the first `count` rows. Dropping
+tracks is one boolean-index compaction per array; the points go to calcOpticalFlowPyrLK
+without conversion.
+
+Measured at 640x480 (x86, 1 core, python -m vision.tracking, a panning textured scene with a
+moving occluder, 100 frames):
+    lecture code                       100 tracks at the start, 2 at the end
+    manager                            ~95 tracks (never below ~89), ~4.2 ms per frame
+    manager without the fb check       ~99 tracks, ~2.2 ms per frame
+The forward-backward check doubles the LK cost. It cuts the share of tracks that move more
+than 1 pixel differently from the camera from ~17% to ~4.5% (most of the rest sit on the
+moving occluder, i.e. they are correct).
+calcOpticalFlowPyrLK builds the pyramids of both images on every call (four per frame with
+the check). Running LK level by level on pyramids built once per frame (the Python bindings
+do not accept the levels of cv2.buildOpticalFlowPyramid) gave the same tracks but was not
+faster (~3.1-4.1 against ~2.9-4.0 ms per frame for 100 points), so the images are passed.
+
+Usage:
+    tracker = TrackManager(max_tracks=100)
+    tracker.update(gray)                  # every frame (copy=False: keeps gray itself, no copy)
+    tracker.points[:tracker.count]        # (count, 2) current positions
+    tracker.draw(frame)
+
+    python -m vision.tracking --width 640 --height 480
+'''
+
+import argparse
+import json
+
+import cv2
+import numpy as np
+
+
+class TrackManager:
+
+    def __init__(self, max_tracks=100, cols=5, rows=4, min_per_cell=None, fb_threshold=1.0, history=16,
+                 winSize=15, maxLevel=2, qualityLevel=0.01, minDistance=7, blockSize=7):
+        '''
+        max_tracks    capacity; every cell is topped up to max_tracks / (cols * rows) tracks
+        cols, rows    re-seeding grid
+        min_per_cell  a cell with fewer tracks than this gets new ones (default: half of its
+                      share of max_tracks, rounded up)
+        fb_threshold  largest forward-backward error (pixels) of a kept track (None: no check)
+        history       positions and errors kept per track (for drawing and statistics)
+        The rest are the cv2.calcOpticalFlowPyrLK and cv2.goodFeaturesToTrack parameters.
+        '''
+        self.capacity = max_tracks
+        self.cols = cols
+        self.rows = rows
+        self.per_cell = max(1, max_tracks // (cols * rows))
+        self.min_per_cell = (self.per_cell + 1) // 2 if min_per_cell is None else min_per_cell
+        self.fb_threshold = fb_threshold
+        self.lk_params = dict(winSize=(winSize, winSize), maxLevel=maxLevel,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+        self.feature_params = dict(qualityLevel=qualityLevel, minDistance=minDistance, blockSize=blockSize)
+
+        # Struct of arrays: row i of every array belongs to the same track, rows < count are live
+        self.ids = np.zeros(max_tracks, dtype=np.int64)
+        self.points = np.zeros((max_tracks, 2), dtype=np.float32)
+        self.ages = np.zeros(max_tracks, dtype=np.int32)
+        self.positions = np.zeros((max_tracks, history, 2), dtype=np.float32)   # ring buffer per track
+        self.errors = np.zeros((max_tracks, history), dtype=np.float32)         # LK error per frame
+        self.fb_errors = np.zeros(max_tracks, dtype=np.float32)                 # of the last frame
+        self.history = history
+        self.buffers = {}
+        self.reset()
+
+    def _buffer(self, key, shape, dtype=np.uint8):
+        buf = self.buffers.get(key)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self.buffers[key] = buf
+        return buf
+
+    def reset(self):
+        '''Drops all tracks (the next frame seeds every cell).'''
+        self.count = 0
+        self.next_id = 0
+        self.previous = None
+        self.frames = 0
+        self.totals = {"born": 0, "lost": 0, "fb_rejected": 0, "left_frame": 0}
+
+    # --- Struct of arrays ------------------------------------------------------------------
+
+    def _arrays(self):
+        return (self.ids, self.points, self.ages, self.positions, self.errors, self.fb_errors)
+
+    def _keep(self, keep):
+        '''Compacts the live rows: tracks with keep=False are removed, the order is kept.'''
+        n = int(keep.sum())
+        for array in self._arrays():
+            array[:n] = array[:self.count][keep]
+        self.count = n
+
+    def _add(self, points):
+        '''Appends new tracks (as many as there is room for).'''
+        points = points[:self.capacity - self.count]
+        a, b = self.count, self.count + len(points)
+        self.ids[a:b] = np.arange(self.next_id, self.next_id + len(points))
+        self.points[a:b] = points
+        self.ages[a:b] = 0
+        self.positions[a:b] = points[:, None, :]       # the whole history starts at the seed point
+        self.errors[a:b] = 0
+        self.fb_errors[a:b] = 0
+        self.next_id += len(points)
+        self.count = b
+        self.totals["born"] += len(points)
+
+    # --- Tracking --------------------------------------------------------------------------
+
+    def _track(self, gray):
+        '''Moves the live tracks to the current frame and drops the failed ones.'''
+        n = self.count
+        p0 = self.points[:n].reshape(-1, 1, 2)
+        p1, status, err = cv2.calcOpticalFlowPyrLK(self.previous, gray, p0, None, **self.lk_params)
+        keep = status.ravel() == 1
+        self.totals["lost"] += int(n - keep.sum())
+
+        if self.fb_threshold is not None:
+            # Track the result back; a good track returns to its start
+            back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self.previous, p1, None, **self.lk_params)
+            fb = np.abs(back - p0).reshape(-1, 2).max(axis=1)
+            self.fb_errors[:n] = fb
+            bad = keep & ((back_status.ravel() != 1) | (fb > self.fb_threshold))
+            self.totals["fb_rejected"] += int(bad.sum())
+            keep &= ~bad
+
+        p1 = p1.reshape(-1, 2)
+        h, w = gray.shape
+        inside = (p1[:, 0] >= 0) & (p1[:, 0] < w) & (p1[:, 1] >= 0) & (p1[:, 1] < h)
+        self.totals["left_frame"] += int((keep & ~inside).sum())
+        keep &= inside
+
+        # Update every live track, then drop the failed ones
+        slot = self.ages[:n] % self.history
+        self.points[:n] = p1
+        self.ages[:n] += 1
+        self.positions[np.arange(n), (slot + 1) % self.history] = p1
+        self.errors[np.arange(n), (slot + 1) % self.history] = err.ravel()
+        self._keep(keep)
+
+    def cell_counts(self, shape):
+        '''Number of live tracks in every grid cell, (rows, cols).'''
+        h, w = shape[:2]
+        p = self.points[:self.count]
+        c = np.minimum((p[:, 0] * self.cols / w).astype(np.int64), self.cols - 1)
+        r = np.minimum((p[:, 1] * self.rows / h).astype(np.int64), self.rows - 1)
+        return np.bincount(r * self.cols + c, minlength=self.rows * self.cols).reshape(self.rows, self.cols)
+
+    def _reseed(self, gray):
+        '''Tops up the cells with fewer than min_per_cell tracks.'''
+        h, w = gray.shape
+        counts = self.cell_counts(gray.shape).ravel()
+        empty = np.flatnonzero(counts < self.min_per_cell)
+        if len(empty) == 0 or self.count >= self.capacity:
+            return 0
+
+        # Mask: 255 where a new corner may go, 0 around the existing tracks
+        mask = self._buffer("mask", gray.shape)
+        mask[:] = 255
+        radius = int(self.feature_params["minDistance"])
+        for x, y in self.points[:self.count]:
+            cv2.circle(mask, (int(x), int(y)), radius, 0, -1)
+
+        xs = np.linspace(0, w, self.cols + 1).astype(int)
+        ys = np.linspace(0, h, self.rows + 1).astype(int)
+        born = 0
+        for i in empty:
+            room = self.capacity - self.count
+            if room <= 0:
+                break
+            r, c = divmod(int(i), self.cols)
+            x0, x1, y0, y1 = xs[c], xs[c + 1], ys[r], ys[r + 1]
+            # goodFeaturesToTrack on the cell only: the cost is proportional to the empty area
+            corners = cv2.goodFeaturesToTrack(gray[y0:y1, x0:x1], min(self.per_cell - counts[i], room),
+                                              mask=mask[y0:y1, x0:x1], **self.feature_params)
+            if corners is not None:
+                corners = corners.reshape(-1, 2) + np.float32([x0, y0])
+                self._add(corners)
+                born += len(corners)
+        return born
+
+    def update(self, gray, copy=True):
+        '''
+        Tracks the live points into gray, drops failed tracks and re-seeds empty cells.
+        copy=False keeps a reference to gray as the previous frame instead of copying it: the
+        caller must not change the array before the next update (e.g. a fresh cvtColor result
+        every frame, or two buffers taking turns).
+        '''
+        if self.previous is not None and self.previous.shape != gray.shape:
+            self.reset()
+        if self.previous is not None and self.count:
+            self._track(gray)
+        self._reseed(gray)
+        self.frames += 1
+
+        if copy:
+            # Keep the frame in our own buffer (the caller may reuse its array)
+            self.previous = self._buffer("previous", gray.shape)
+            np.copyto(self.previous, gray)
+        else:
+            self.previous = gray
+        return self.points[:self.count]
+
+    # --- Output ----------------------------------------------------------------------------
+
+    def tracks(self):
+        '''The live tracks as a dict of arrays (copies): id, point, age, mean error, fb error.'''
+        n = self.count
+        # Tracked frames in the history (the seed slot holds 0 until it is overwritten)
+        tracked = np.minimum(self.ages[:n], self.history)
+        return {
+            "id": self.ids[:n].copy(),
+            "point": self.points[:n].copy(),
+            "age": self.ages[:n].copy(),
+            "mean_error": self.errors[:n].sum(axis=1) / np.maximum(tracked, 1),
+            "fb_error": self.fb_errors[:n].copy(),
+        }
+
+    def trail(self, i):
+        '''Last positions of live track i, oldest first.'''
+        length = min(int(self.ages[i]) + 1, self.history)
+        newest = int(self.ages[i]) % self.history
+        order = (newest - np.arange(length)[::-1]) % self.history
+        return self.positions[i, order]
+
+    def draw(self, image, color=(0, 255, 0), point_color=(0, 0, 255)):
+        '''Draws the trail and the current position of every track into image (BGR).'''
+        trails = [self.trail(i).astype(np.int32) for i in range(self.count) if self.ages[i] > 0]
+        if trails:
+            cv2.polylines(image, trails, False, color, 2)
+        for x, y in self.points[:self.count]:
+            cv2.circle(image, (int(x), int(y)), 4, point_color, -1)
+        return image
+
+    def stats(self):
+        return {"tracks": self.count, "frames": self.frames, **self.totals}
+
+
+def panning_sequence(width, height, count, seed=0):
+    '''
+    Test video for tracking: a textured scene that pans 2 pixels per frame to the right and
+    1 down, with a square occluder moving the other way. Returns (frames, shift per frame).
+    '''
+    from vision.background import static_scene
+
+    rng = np.random.default_rng(seed)
+    big = (height + 2 * count + 20, width + 3 * count + 20)
+    texture = cv2.GaussianBlur(rng.integers(0, 256, big, dtype=np.uint8), (0, 0), 2.0)
+    scene = cv2.cvtColor(static_scene(big[1], big[0], 1, seed)[0], cv2.COLOR_BGR2GRAY)
+    world = cv2.addWeighted(scene, 0.5, texture, 0.5, 0)
+    size = height // 5
+    frames = []
+    for i in range(count):
+        # The camera moves left and up, so the content moves right (+2) and down (+1)
+        x, y = 2 * count - 2 * i, count - i
+        frame = world[y:y + height, x:x + width].copy()
+        ox = (width - size) - (i * 5) % (width - size)
+        cv2.rectangle(frame, (ox, height // 3), (ox + size, height // 3 + size), 200, -1)
+        frames.append(cv2.add(frame, rng.integers(0, 4, frame.shape, dtype=np.uint8)))
+    return frames, np.float32([2, 1])
+
+
+def lecture_tracking(frames, maxCorners=100):
+    '''18_optical_flow_and_tracking.py without drawing: the number of tracks per frame.'''
+    lk_params = dict(winSize=(15, 15), maxLevel=2,
+                     criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+    p0 = cv2.goodFeaturesToTrack(frames[0], maxCorners, 0.3, 7, blockSize=7)
+    counts = []
+    for old, new in zip(frames, frames[1:]):
+        if p0 is None or len(p0) == 0:
+            counts.append(0)
+            continue
+        p1, st, _ = cv2.calcOpticalFlowPyrLK(old, new, p0, None, **lk_params)
+        p0 = p1[st == 1].reshape(-1, 1, 2)
+        counts.append(len(p0))
+    return counts
+
+
+def main():
+    import time
+
+    parser = argparse.ArgumentParser(description="Compare the track manager with the lecture tracking loop")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--tracks", type=int, default=100)
+    args = parser.parse_args()
+
+    frames, shift = panning_sequence(args.width, args.height, args.frames)
+    report = {"lecture": {"tracks_at_end": lecture_tracking(frames, args.tracks)[-1]}}
+
+    for name, fb in (("manager", 1.0), ("manager, no fb check", None)):
+        tracker = TrackManager(args.tracks, fb_threshold=fb)
+        counts, times, errors = [], [], []
+        for frame in frames:
+            previous = tracker.points[:tracker.count].copy()
+            ids_before = tracker.ids[:tracker.count].copy()
+            start = time.perf_counter()
+            tracker.update(frame, copy=False)
+            times.append(1000 * (time.perf_counter() - start))
+            counts.append(tracker.count)
+            # Tracking error of the tracks that survived the frame (against the true shift)
+            survived = np.isin(tracker.ids[:tracker.count], ids_before) & (tracker.ages[:tracker.count] > 0)
+            if survived.any():
+                before = previous[np.searchsorted(ids_before, tracker.ids[:tracker.count][survived])]
+                moved = tracker.points[:tracker.count][survived] - before
+                errors.append(np.linalg.norm(moved - shift, axis=1))
+        errors = np.concatenate(errors)
+        report[name] = {
+            "tracks_mean": round(float(np.mean(counts[1:])), 1),
+            "tracks_min": int(np.min(counts[1:])),
+            "ms_per_frame": round(float(np.median(times[1:])), 3),
+            "error_p50_px": round(float(np.median(errors)), 3),
+            "error_p99_px": round(float(np.percentile(errors, 99)), 3),
+            "tracks_off_by_1px": round(float(np.mean(errors > 1.0)), 4),
+            **tracker.stats(),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()